@@ -0,0 +1,74 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gmail_body import html_to_text
+
+# Number of conversions timed per method
+HTML_TO_TEXT_ITERATIONS = int(os.environ.get('HTML_TO_TEXT_ITERATIONS', 200))
+
+def build_marketing_email(offer_count=60):
+    """
+    Table-heavy HTML resembling the promotional mail sent from maybankard@edm.maybank2u.com.my
+    """
+    offers = ''.join(f"""
+        <tr>
+            <td class="offer" style="padding:12px;font-family:Arial,sans-serif;">
+                <a href="https://example.com/offer/{i}"><img src="https://example.com/img/{i}.png" alt="" width="120"></a>
+            </td>
+            <td style="padding:12px;">
+                <h3 style="margin:0;color:#ffc83d;">Offer {i}: Enjoy up to {i % 30 + 5}% cashback</h3>
+                <p>Spend RM{i * 10}&nbsp;or more with your card &amp; get rewarded.<br>Valid until 31 Dec.</p>
+                <!-- tracking pixel {i} -->
+            </td>
+        </tr>""" for i in range(offer_count))
+
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Your monthly card privileges</title>
+    <style>
+        body {{ margin: 0; padding: 0; }}
+        .offer {{ border-bottom: 1px solid #eeeeee; }}
+    </style>
+    <script>window.dataLayer = window.dataLayer || [];</script>
+</head>
+<body>
+    <table width="100%" cellpadding="0" cellspacing="0">
+        <tr><td><h1>Card privileges this month</h1></td></tr>
+        {offers}
+        <tr><td><p>This is a computer-generated email. Please do not reply.</p></td></tr>
+    </table>
+</body>
+</html>"""
+
+def main():
+    html = build_marketing_email()
+    print(f'Sample email: {len(html) / 1024:.1f} KiB of HTML, {HTML_TO_TEXT_ITERATIONS} conversions per method\n')
+
+    methods = ['fast']
+    try:
+        import bs4
+        methods.append('bs4')
+    except ImportError:
+        print('beautifulsoup4 is not installed; timing the fast path only\n')
+
+    timings = {}
+    for method in methods:
+        seconds = timeit.timeit(lambda: html_to_text(html, method), number=HTML_TO_TEXT_ITERATIONS)
+        timings[method] = seconds / HTML_TO_TEXT_ITERATIONS * 1000
+        print(f'{method:<6} {timings[method]:>8.3f} ms per email')
+
+    if 'bs4' in timings:
+        print(f"\nfast path is {timings['bs4'] / timings['fast']:.1f}x faster than BeautifulSoup")
+
+        # Both paths must produce the same text for the switch to be safe
+        if html_to_text(html, 'fast') != html_to_text(html, 'bs4'):
+            print('Output differs between the fast and bs4 paths')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
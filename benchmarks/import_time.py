@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+# Maximum time (ms) a helper module may take to import in a fresh interpreter
+IMPORT_TIME_BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', 250))
+
+modules = [
+    'get_access_token',
+    'google_drive_file_mgmt',
+    'relocate_emails_to_folders',
+    'retrieve_gmail_attachments',
+    'retrieve_gmail_body',
+    'send_gmail_message',
+]
+
+# Runs in a child interpreter: blocks all outbound connections, then times the import
+probe = """
+import socket, sys, time
+
+def _blocked(*args, **kwargs):
+    raise RuntimeError('Network access attempted during import')
+
+socket.socket.connect = _blocked
+socket.create_connection = _blocked
+
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(f'{(time.perf_counter() - start) * 1000:.1f}')
+"""
+
+def main():
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # Importing must not depend on credentials being configured
+    env = {key: value for key, value in os.environ.items() if key != 'EMAIL'}
+
+    over_budget = []
+    for module in modules:
+        result = subprocess.run([sys.executable, '-c', probe, module], cwd=repo_dir, env=env, capture_output=True, text=True)
+
+        if result.returncode != 0:
+            print(f'{module:<30} FAILED\n{result.stderr.strip()}')
+            over_budget.append(module)
+            continue
+
+        elapsed_ms = float(result.stdout.strip().splitlines()[-1])
+        status = 'ok' if elapsed_ms <= IMPORT_TIME_BUDGET_MS else 'OVER BUDGET'
+        print(f'{module:<30} {elapsed_ms:>8.1f} ms  {status}')
+
+        if elapsed_ms > IMPORT_TIME_BUDGET_MS:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f'\n{len(over_budget)} module(s) exceeded the {IMPORT_TIME_BUDGET_MS:.0f} ms import budget')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,14 @@
 import pandas as pd
 from datetime import datetime
-from relocate_emails_to_folders import move_emails, list_all_folders
-from retrieve_gmail_attachments import retrieve_gmail_attachments
-from retrieve_gmail_body import retrieve_gmail_body
+from relocate_emails_to_folders import move_emails, list_all_folders, mark_emails_processed, get_processed_label
+from retrieve_gmail_attachments import download_message_attachments
+from gmail_planner import mailbox_consumer, scan_mailbox
+from gmail_sync import save_checkpoint
 from google_drive_file_mgmt import google_drive_upload_file, google_drive_get_link, google_drive_download_file, google_drive_list_files
 from send_gmail_message import send_email_gmail
 from pypdf import PdfReader
 import os
 import re
-import time
 import calendar
 import shutil
 import glob
@@ -18,7 +18,6 @@ load_dotenv('.env')
 # Define timing parameters
 today = datetime.today()
 current_year = today.year
-max_retries = 5
 
 # Create Downloads local directory
 download_dir = os.path.join(os.getcwd(), 'Downloads')
@@ -28,20 +27,35 @@ os.makedirs(download_dir, exist_ok=True)
 sender_email = os.environ['EMAIL']
 statement_pw = os.environ['MAYBANK_STMT_PW']
 
+# Only scan mail that arrived since the previous run when a sync checkpoint is available
+incremental_sync = os.environ.get('GMAIL_INCREMENTAL_SYNC', '').lower() in ('1', 'true', 'yes')
+
 root_folder = 'JULIE FINANCING'
 
 # List of relevant email addresses from Maybank
 relevant_maybank_emails = ['m2u@maybank.com.my', "m2u@bills.maybank2u.com.my", "m2u@stmts.maybank2u.com.my", 'maybankard@edm.maybank2u.com.my']
 
+# Statements this pipeline has already ingested carry its own processed label
+processed_label = get_processed_label('Consolidated')
+
+# Sweep outstanding Maybank emails into their folder and find monthly statements in a single mailbox scan
+inbox_sweep = mailbox_consumer('inbox_sweep', ['INBOX'], email_filter=relevant_maybank_emails, profile='ids', add_labels=['MayBank'], remove_labels=['INBOX'])
+statements = mailbox_consumer('statements', ['MayBank'], subject_filter=["Savings Account Statement "], profile='attachments', exclude_labels=[processed_label])
+mailbox_shares, sync_checkpoint = scan_mailbox(sender_email, today, 32, [inbox_sweep, statements], incremental=incremental_sync)
+
 # Move outstanding Maybank emails into designated folder
-maybank_df = retrieve_gmail_body(sender_email, today, 32, ['INBOX'], True, email_filter=relevant_maybank_emails)
-if maybank_df.empty:
+if len(mailbox_shares['inbox_sweep']) == 0:
     print('No new emails found to move.')
 else:
-    move_emails(sender_email, maybank_df['Id'].to_list(), ['MayBank'], ['INBOX'])
+    move_emails(sender_email, [message['id'] for message in mailbox_shares['inbox_sweep']], inbox_sweep['add_labels'], inbox_sweep['remove_labels'])
 
 # Download monthly statement
-statement_files = retrieve_gmail_attachments(sender_email, today, 32, 'MayBank', subject_filter=["Savings Account Statement "])
+# Statements already ingested on earlier runs carry the processed label and are excluded from the scan
+statement_message_ids = {filename: message_id for message_id, filename in download_message_attachments(sender_email, mailbox_shares['statements'], filename_pattern='*.pdf', return_message_id=True)}
+statement_files = list(statement_message_ids)
+
+# Statements whose rows made it into a workbook that was uploaded to Drive
+uploaded_files = []
 
 if len(statement_files) == 0:
     print('No MayBank statements found this month.')
@@ -49,37 +63,19 @@ else:
     retrieved_years = list({file.split('_')[1][0:4] for file in statement_files})
     retrieved_monthYears = [file.split('_')[1][0:6] for file in statement_files]
 
-    for i in range(max_retries):
-        try:
-            yearly_summaries = google_drive_list_files(root_folder)
-            break
-        except Exception as e:
-            if i < max_retries - 1:
-                print(f'Attempt {i+1} failed. Retrying to list files...')
-                time.sleep(5)
-            else:
-                print('Max attempts reached.')
-                raise e
-            
+    yearly_summaries = google_drive_list_files(root_folder)
+    ingested_files = []
+
     for year in retrieved_years:
         master_filename = os.path.join(download_dir, f'{year} Compiled Debit Statements.xlsx')
 
-        if master_filename not in yearly_summaries:
+        # Drive listings hold bare file names, not local paths
+        if os.path.basename(master_filename) not in yearly_summaries:
             print(f'No {year} master summary file found in Google Drive. Initializing new file...')
             temp_df = pd.DataFrame()
             temp_df.to_excel(master_filename, index=False)
         else:
-            for i in range(max_retries):
-                try:
-                    google_drive_download_file(root_folder, master_filename)
-                    break
-                except Exception as e:
-                    if i < max_retries - 1:
-                        print(f'Attempt {i+1} failed. Retrying to list files...')
-                        time.sleep(5)
-                    else:
-                        print('Max attempts reached.')
-                        raise e
+            google_drive_download_file(root_folder, os.path.basename(master_filename))
 
         corresponding_statements = [file for file in statement_files if year in file]
 
@@ -170,6 +166,8 @@ else:
                 with pd.ExcelWriter(master_filename, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
                     spending_records_df.to_excel(writer, index=False, sheet_name=f"{statement_month}{statement_year}")
 
+                ingested_files.append(file)
+
             else:
                 print('Number of rows extracted are inconsistent. Skipping...')
 
@@ -177,19 +175,12 @@ else:
 
     document_link = google_drive_get_link(root_folder)
 
+    uploaded_years = set()
     for file in files_to_upload:
-        for i in range(max_retries):
-            try:
-                google_drive_upload_file(file, root_folder, delete_sourcefile=True)
-                break
-            except Exception as e:
-                if i < max_retries - 1:
-                    print(f'Attempt {i+1} failed. Retrying to list files...')
-                    time.sleep(5)
-                else:
-                    print('Max attempts reached.')
-                    raise e
-                
+        # Replace last run's workbook with a new revision instead of adding another copy
+        if google_drive_upload_file(file, root_folder, delete_sourcefile=True, overwrite=True):
+            uploaded_years.add(os.path.basename(file).split(' ')[0])
+
     # Define email subject and body
         email_subject = f'{month_name}{statement_year} Bank Statement Transaction Compilation'
         email_body = """
@@ -216,17 +207,7 @@ else:
         """
 
         # Send email
-        for i in range(max_retries):
-            try:
-                send_email_gmail(sender_email, [sender_email], [], [], email_subject, email_body, '', [])
-                break
-            except Exception as e:
-                if i < max_retries - 1:
-                    print(f'Attempt {i+1} failed. Resending email...')
-                    time.sleep(2)
-                else:
-                    print('All attempts failed.')
-                    raise e
+        send_email_gmail(sender_email, [sender_email], [], [], email_subject, email_body, '', [])
 
     else:
         email_subject = f'[ERROR] {month_name}{statement_year} Bank Statement Transaction Compilation'
@@ -248,19 +229,23 @@ else:
         </html>
         """
 
-        for i in range(max_retries):
-            try:
-                send_email_gmail(sender_email, [sender_email], [], [], email_subject, email_body, '', [])
-                break
-            except Exception as e:
-                if i < max_retries - 1:
-                    print(f'Attempt {i+1} failed. Resending email...')
-                    time.sleep(2)
-                else:
-                    print('All attempts failed.')
-                    raise e
-        
+        send_email_gmail(sender_email, [sender_email], [], [], email_subject, email_body, '', [])
+
+    # Record statement emails as ingested only once their year's workbook is confirmed in Drive, so later runs skip them
+    uploaded_files = [file for file in ingested_files if file.split('_')[1][0:4] in uploaded_years]
+    mark_emails_processed(sender_email, [statement_message_ids[file] for file in uploaded_files], processed_label)
+
+# Only move the checkpoint past this scan once every statement it found reached Drive. A statement that
+# failed row validation or upload keeps the checkpoint where it was, so the next run scans it again
+unfinished_files = [file for file in statement_files if file not in uploaded_files]
+if sync_checkpoint and not unfinished_files:
+    save_checkpoint(sender_email, sync_checkpoint['scope'], sync_checkpoint['history_id'])
+elif sync_checkpoint:
+    print(f'{len(unfinished_files)} statement(s) not ingested; sync checkpoint left unchanged')
+
 # Remove already-processed files
+# The attachment index only skips downloads that are still on disk, so after this cleanup it only helps a
+# rerun of an interrupted run; ingested statements are kept out of later scans by the processed label
 for file in statement_files:
     if os.path.exists(os.path.join(download_dir, file)):
         os.remove(os.path.join(download_dir, file))
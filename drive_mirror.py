@@ -0,0 +1,117 @@
+import threading
+import sqlite3
+import time
+import os
+
+# Metadata compared to decide whether a mirrored copy is still current. Google-native documents have no
+# md5Checksum, so their modifiedTime and headRevisionId are compared as well
+MIRROR_FIELDS = 'id,name,mimeType,md5Checksum,modifiedTime,headRevisionId'
+
+_write_lock = threading.Lock()
+
+def _get_mirror_dir():
+    return os.environ.get('DRIVE_MIRROR_DIR', os.path.join(os.getcwd(), '.drive_mirror'))
+
+def _get_mirror_max_bytes():
+    return int(os.environ.get('DRIVE_MIRROR_MAX_BYTES', 500 * 1024 * 1024))
+
+def _connect_mirror_db():
+    mirror_dir = _get_mirror_dir()
+    os.makedirs(mirror_dir, exist_ok=True)
+
+    conn = sqlite3.connect(os.path.join(mirror_dir, 'index.db'), timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS drive_mirror (
+            file_id TEXT PRIMARY KEY,
+            md5_checksum TEXT,
+            modified_time TEXT,
+            head_revision_id TEXT,
+            size_bytes INTEGER NOT NULL,
+            last_accessed REAL NOT NULL
+        )
+    """)
+    return conn
+
+def get_mirror_path(file_id):
+    """
+    Local path holding the mirrored copy of a Drive file, creating the mirror directory if needed
+    """
+    mirror_dir = _get_mirror_dir()
+    os.makedirs(mirror_dir, exist_ok=True)
+    return os.path.join(mirror_dir, file_id)
+
+def is_mirror_current(file_id, metadata):
+    """
+    Whether the mirrored copy of a Drive file matches its current metadata (as returned with MIRROR_FIELDS)
+
+    A current copy is marked as recently used.
+    """
+    mirror_path = get_mirror_path(file_id)
+    if not os.path.exists(mirror_path):
+        return False
+
+    conn = _connect_mirror_db()
+    try:
+        row = conn.execute("""
+            SELECT md5_checksum, modified_time, head_revision_id, size_bytes
+            FROM drive_mirror
+            WHERE file_id = ?
+        """, (file_id,)).fetchone()
+
+        if row is None or os.path.getsize(mirror_path) != row[3]:
+            return False
+
+        if row[:3] != (metadata.get('md5Checksum'), metadata.get('modifiedTime'), metadata.get('headRevisionId')):
+            return False
+
+        with _write_lock:
+            conn.execute("UPDATE drive_mirror SET last_accessed = ? WHERE file_id = ?", (time.time(), file_id))
+            conn.commit()
+    finally:
+        conn.close()
+
+    return True
+
+def record_mirrored_file(file_id, metadata):
+    """
+    Index a copy just written to get_mirror_path(file_id), then evict least recently used copies until
+    the mirror fits within DRIVE_MIRROR_MAX_BYTES
+    """
+    size_bytes = os.path.getsize(get_mirror_path(file_id))
+
+    with _write_lock:
+        conn = _connect_mirror_db()
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO drive_mirror (file_id, md5_checksum, modified_time, head_revision_id, size_bytes, last_accessed)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (file_id, metadata.get('md5Checksum'), metadata.get('modifiedTime'), metadata.get('headRevisionId'), size_bytes, time.time()))
+            _evict_least_recently_used(conn, keep_file_id=file_id)
+            conn.commit()
+        finally:
+            conn.close()
+
+def _evict_least_recently_used(conn, keep_file_id):
+    max_bytes = _get_mirror_max_bytes()
+    total_bytes = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM drive_mirror").fetchone()[0]
+    if total_bytes <= max_bytes:
+        return
+
+    evict = []
+    for file_id, size_bytes in conn.execute("SELECT file_id, size_bytes FROM drive_mirror ORDER BY last_accessed"):
+        if total_bytes <= max_bytes:
+            break
+        # The file just downloaded is about to be used, even if it alone exceeds the limit
+        if file_id == keep_file_id:
+            continue
+        evict.append((file_id,))
+        total_bytes -= size_bytes
+
+    for (file_id,) in evict:
+        try:
+            os.remove(get_mirror_path(file_id))
+        except FileNotFoundError:
+            pass
+
+    conn.executemany("DELETE FROM drive_mirror WHERE file_id = ?", evict)
+    print(f'Evicted {len(evict)} file(s) from the local Drive mirror')
@@ -1,12 +1,9 @@
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
 from datetime import datetime
 import requests
 import os
-import pandas as pd
 import sqlite3
+import threading
+import time
 
 SCOPES = [
     'https://mail.google.com/',
@@ -18,6 +15,14 @@ SCOPES = [
 ]
 
 google_JSON_credentials = os.environ.get('GOOGLE_USER_API_CREDENTIALS', '')
+
+# Refresh access tokens this many seconds before Google reports them as expired
+TOKEN_EXPIRY_MARGIN = 300
+
+# In-memory token cache shared by every module in the process, keyed by email
+_token_cache = {}
+_token_locks = {}
+_token_locks_guard = threading.Lock()
 # credentials_dir = os.environ['CREDENTIALS_DIR']
 # refresh_token_dir = os.environ['GOOGLE_REFRESH_TOKEN_DIR']
 
@@ -53,15 +58,95 @@ def _get_refreshToken_by_user(conn, email: str):
     """, (email,))
     return cur.fetchone()[0]
 
-def get_access_token(email):
+def _get_token_store_path():
+    return os.environ.get('TOKEN_STORE_DB', 'token_store.db')
+
+def _get_token_fernet():
+    # Tokens are encrypted with the key that protects secrets.db.enc, so the store is safe to carry between
+    # CI runs (the workflow caches it). Without the key, tokens are only reused within the process
+    key = os.environ.get('DB_DECRYPTION_KEY')
+    if not key:
+        return None
+
+    from cryptography.fernet import Fernet
+    return Fernet(key.encode())
+
+def _connect_token_store():
+    conn = sqlite3.connect(_get_token_store_path())
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS access_tokens (
+            username TEXT PRIMARY KEY,
+            access_token TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    return conn
+
+def _load_stored_access_token(email):
+    fernet = _get_token_fernet()
+    if fernet is None:
+        return None
+
+    try:
+        conn = _connect_token_store()
+        try:
+            row = conn.execute("""
+                SELECT access_token, expires_at
+                FROM access_tokens
+                WHERE username = ?
+            """, (email,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f'Unable to read stored access token: {e}')
+        return None
+
+    if row is None:
+        return None
+
+    from cryptography.fernet import InvalidToken
+    try:
+        access_token = fernet.decrypt(row[0].encode()).decode()
+    except InvalidToken:
+        # Written under a previous key; a new token will replace it
+        return None
+    return {'access_token': access_token, 'expires_at': row[1]}
+
+def _store_access_token(email, access_token, expires_at):
+    fernet = _get_token_fernet()
+    if fernet is None:
+        return
+
+    try:
+        conn = _connect_token_store()
+        try:
+            conn.execute("""
+                INSERT INTO access_tokens (username, access_token, expires_at, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(username) DO UPDATE SET
+                    access_token = excluded.access_token,
+                    expires_at = excluded.expires_at,
+                    updated_at = excluded.updated_at
+            """, (email, fernet.encrypt(access_token.encode()).decode(), expires_at))
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f'Unable to store access token: {e}')
+
+def _request_access_token(email):
     token_url = 'https://oauth2.googleapis.com/token'
 
     # Connect to SQLite DB
     conn = sqlite3.connect("secrets.db")
 
-    # Retrieve relevant credentials by user and platform as Google
-    client_id, client_secret = _get_clientID_and_clientSecret(conn)
-    refresh_token = _get_refreshToken_by_user(conn, email)
+    try:
+        # Retrieve relevant credentials by user and platform as Google
+        client_id, client_secret = _get_clientID_and_clientSecret(conn)
+        refresh_token = _get_refreshToken_by_user(conn, email)
+    finally:
+        conn.close()
 
     data = {
         'client_id': client_id,
@@ -72,11 +157,62 @@ def get_access_token(email):
     response = requests.post(token_url, data=data)
     response.raise_for_status()
     tokens = response.json()
-    return tokens['access_token']
+    return tokens['access_token'], time.time() + int(tokens.get('expires_in', 3600))
+
+def _get_token_lock(email):
+    with _token_locks_guard:
+        return _token_locks.setdefault(email, threading.Lock())
+
+def _is_token_fresh(cached):
+    return cached is not None and cached['expires_at'] - TOKEN_EXPIRY_MARGIN > time.time()
+
+def get_access_token(email, force_refresh=False):
+    """
+    Return a valid access token for the user, refreshing it only when it is close to expiry
+
+    email: str
+        User's email address
+
+    force_refresh: bool
+        Whether to discard the cached token (e.g. after the API rejected it with a 401)
+
+    Issued tokens are also kept, encrypted with DB_DECRYPTION_KEY, in TOKEN_STORE_DB (default token_store.db)
+    so a later process can reuse them until they near expiry. Without DB_DECRYPTION_KEY nothing is stored.
+    """
+    cached = _token_cache.get(email)
+    if not force_refresh and _is_token_fresh(cached):
+        return cached['access_token']
+
+    stale_token = cached['access_token'] if cached else None
+
+    # Only one thread per user performs the refresh, the others wait and reuse its result
+    with _get_token_lock(email):
+        cached = _token_cache.get(email)
+        if _is_token_fresh(cached) and (not force_refresh or cached['access_token'] != stale_token):
+            return cached['access_token']
+
+        # Reuse a token issued to an earlier process if it is still valid
+        stored = None if force_refresh else _load_stored_access_token(email)
+        if _is_token_fresh(stored):
+            _token_cache[email] = stored
+            return stored['access_token']
+
+        access_token, expires_at = _request_access_token(email)
+        _token_cache[email] = {'access_token': access_token, 'expires_at': expires_at}
+        _store_access_token(email, access_token, expires_at)
+        return access_token
+
+def get_user_access_token(force_refresh=False):
+    """
+    Return a valid access token for the account configured in the EMAIL environment variable
+    """
+    return get_access_token(os.environ['EMAIL'], force_refresh)
 
 
 def reset_credentials():
     # NOTE: run this code to update token with new scopes. Download JSON file from google developer console
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     flow = InstalledAppFlow.from_client_secrets_file(google_JSON_credentials, SCOPES)
     creds = flow.run_local_server(port=0, access_type='offline', prompt='consent')
     
@@ -0,0 +1,212 @@
+from fnmatch import fnmatch
+import threading
+import tempfile
+import hashlib
+import sqlite3
+import base64
+import re
+import os
+from google_api_client import google_request
+
+base_url = 'https://gmail.googleapis.com/gmail/v1/users/'
+
+# Size of each chunk read from the attachment response, bounding peak memory per download
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_index_lock = threading.Lock()
+
+def iter_attachment_parts(payload, filename_pattern=None, mime_types=None):
+    """
+    Recursively walk a message payload's MIME tree and yield attachment parts worth downloading
+
+    payload: dict
+        Message payload as returned by messages.get
+
+    filename_pattern: str
+        Case-insensitive shell-style pattern the filename must match e.g. '*.pdf'
+
+    mime_types: list
+        Accepted MIME types e.g. ['application/pdf']
+    """
+    for part in payload.get('parts', []):
+        filename = part.get('filename')
+        attachment_id = part.get('body', {}).get('attachmentId')
+
+        if filename and attachment_id:
+            name_matches = filename_pattern is None or fnmatch(filename.lower(), filename_pattern.lower())
+            type_matches = not mime_types or part.get('mimeType') in mime_types
+            if name_matches and type_matches:
+                yield part
+
+        if 'parts' in part:
+            yield from iter_attachment_parts(part, filename_pattern, mime_types)
+
+class _AttachmentDataWriter:
+    """
+    Pulls the base64url "data" field out of a streamed attachments.get JSON response and decodes it to a
+    file chunk by chunk, hashing the decoded bytes on the way
+    """
+    data_key_pattern = re.compile(rb'"data"\s*:\s*"')
+
+    def __init__(self, file):
+        self.file = file
+        self.state = 'searching'
+        self.buffer = b''
+        self.pending = b''
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def feed(self, chunk):
+        if self.state == 'searching':
+            self.buffer += chunk
+            match = self.data_key_pattern.search(self.buffer)
+            if not match:
+                # Keep a short tail in case the key is split across chunks
+                self.buffer = self.buffer[-32:]
+                return
+            chunk = self.buffer[match.end():]
+            self.buffer = b''
+            self.state = 'decoding'
+
+        if self.state == 'decoding':
+            end = chunk.find(b'"')
+            if end != -1:
+                chunk = chunk[:end]
+                self.state = 'done'
+            self._decode(chunk, final=self.state == 'done')
+
+    def _decode(self, chunk, final):
+        data = self.pending + chunk
+
+        # base64 decodes in 4-character groups; carry any remainder over to the next chunk
+        usable = len(data) if final else len(data) - len(data) % 4
+        self.pending = data[usable:]
+        data = data[:usable]
+
+        if final and len(data) % 4:
+            data += b'=' * (4 - len(data) % 4)
+
+        if data:
+            decoded = base64.urlsafe_b64decode(data)
+            self.file.write(decoded)
+            self.hasher.update(decoded)
+            self.size += len(decoded)
+
+def _get_index_db_path(downloads_dir):
+    return os.environ.get('ATTACHMENT_INDEX_DB', os.path.join(downloads_dir, '.attachment_index.db'))
+
+def _connect_index_db(downloads_dir):
+    conn = sqlite3.connect(_get_index_db_path(downloads_dir), timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS attachment_index (
+            user_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            part_id TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, message_id, part_id)
+        )
+    """)
+    return conn
+
+def _hash_file(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _is_already_downloaded(user_id, message_id, part_id, file_path, downloads_dir):
+    conn = _connect_index_db(downloads_dir)
+    try:
+        row = conn.execute("""
+            SELECT sha256, size_bytes
+            FROM attachment_index
+            WHERE user_id = ? AND message_id = ? AND part_id = ? AND file_path = ?
+        """, (user_id, message_id, part_id, file_path)).fetchone()
+    finally:
+        conn.close()
+
+    if row is None or not os.path.exists(file_path):
+        return False
+
+    # Only trust the index if the file on disk still has the recorded content
+    sha256, size_bytes = row
+    return os.path.getsize(file_path) == size_bytes and _hash_file(file_path) == sha256
+
+def _record_download(user_id, message_id, part_id, file_path, sha256, size_bytes, downloads_dir):
+    with _index_lock:
+        conn = _connect_index_db(downloads_dir)
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO attachment_index (user_id, message_id, part_id, file_path, sha256, size_bytes)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, message_id, part_id, file_path, sha256, size_bytes))
+            conn.commit()
+        finally:
+            conn.close()
+
+def download_attachment(user_id, message_id, part, downloads_dir):
+    """
+    Stream one attachment part to downloads_dir, skipping it if the same part is already on disk
+
+    user_id: str
+        User's email address
+
+    message_id: str
+        ID of the message holding the attachment
+
+    part: dict
+        Attachment part from iter_attachment_parts
+
+    downloads_dir: str
+        Directory to save the attachment into
+
+    Returns the attachment filename, or None if the download failed.
+    """
+    filename = part['filename']
+    part_id = part.get('partId', filename)
+    file_path = os.path.join(downloads_dir, filename)
+
+    if _is_already_downloaded(user_id, message_id, part_id, file_path, downloads_dir):
+        print(f"Already downloaded: {filename}")
+        return filename
+
+    attachment_url = f"{base_url}{user_id}/messages/{message_id}/attachments/{part['body']['attachmentId']}"
+    response = google_request('GET', attachment_url, stream=True)
+
+    if response.status_code != 200:
+        print(f"Failed to download {filename}: {response.status_code}")
+        response.close()
+        return None
+
+    # Write to a temporary file so an interrupted download never leaves a truncated attachment behind. Each
+    # download gets its own, as attachments with the same name from different emails download concurrently
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=downloads_dir, prefix=f'.{filename}.', suffix='.part', delete=False) as f:
+            temp_path = f.name
+            writer = _AttachmentDataWriter(f)
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                writer.feed(chunk)
+                if writer.state == 'done':
+                    break
+
+        if writer.state != 'done':
+            print(f"Failed to download {filename}: response contained no attachment data")
+            return None
+
+        os.replace(temp_path, file_path)
+    finally:
+        response.close()
+
+        # Anything still at the temporary path is a partial download, including one cut short by an error
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    _record_download(user_id, message_id, part_id, file_path, writer.hasher.hexdigest(), writer.size, downloads_dir)
+
+    print(f"Downloaded: {filename} -> {file_path}")
+    return filename
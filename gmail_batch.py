@@ -0,0 +1,132 @@
+from urllib.parse import quote, urlencode
+import json
+import time
+import uuid
+import os
+import requests
+from google_api_client import google_request, get_backoff_delay, get_max_retries, is_retryable_status
+
+batch_url = 'https://gmail.googleapis.com/batch/gmail/v1'
+
+# Gmail accepts at most 100 calls in a single batch request
+MAX_BATCH_SIZE = 100
+
+def get_batch_size():
+    return min(int(os.environ.get('GMAIL_BATCH_SIZE', MAX_BATCH_SIZE)), MAX_BATCH_SIZE)
+
+def _build_batch_body(user_id, message_ids, params, boundary):
+    query = urlencode(params or [], doseq=True)
+
+    parts = []
+    for i, message_id in enumerate(message_ids):
+        path = f"/gmail/v1/users/{quote(user_id, safe='@')}/messages/{message_id}"
+        if query:
+            path += f'?{query}'
+
+        parts.append(
+            f'--{boundary}\r\n'
+            'Content-Type: application/http\r\n'
+            f'Content-ID: <item{i}>\r\n'
+            '\r\n'
+            f'GET {path}\r\n'
+            '\r\n'
+        )
+
+    parts.append(f'--{boundary}--\r\n')
+    return ''.join(parts)
+
+def _parse_batch_response(response):
+    """
+    Split a multipart/mixed batch response into {item index: (status code, parsed JSON body)}
+    """
+    content_type = response.headers.get('Content-Type', '')
+    boundary = content_type.split('boundary=')[-1].strip().strip('"')
+
+    # Gmail always answers in UTF-8; decoding directly skips requests' charset detection on the whole payload
+    results = {}
+    for part in response.content.decode('utf-8').split(f'--{boundary}'):
+        part = part.strip()
+        if not part or part == '--':
+            continue
+
+        # Each part holds its own MIME headers followed by an embedded HTTP response
+        part = part.replace('\r\n', '\n')
+        mime_headers, _, http_response = part.partition('\n\n')
+        status_line, _, rest = http_response.partition('\n')
+        _, _, body = rest.partition('\n\n')
+
+        content_id = ''
+        for header in mime_headers.split('\n'):
+            name, _, value = header.partition(':')
+            if name.strip().lower() == 'content-id':
+                content_id = value.strip().strip('<>')
+
+        index = int(content_id.split('item')[-1])
+        status_code = int(status_line.split(' ')[1])
+        results[index] = (status_code, json.loads(body) if body.strip() else {})
+
+    return results
+
+def _batch_get_chunk(user_id, message_ids, params):
+    messages = [None] * len(message_ids)
+    pending = list(range(len(message_ids)))
+    attempt = 0
+
+    while pending:
+        boundary = f'batch_{uuid.uuid4().hex}'
+        body = _build_batch_body(user_id, [message_ids[i] for i in pending], params, boundary)
+
+        # The batch only carries messages.get calls, so it is safe to send again
+        response = google_request('POST', batch_url, headers={'Content-Type': f'multipart/mixed; boundary={boundary}'}, data=body, idempotent=True)
+        response.raise_for_status()
+        results = _parse_batch_response(response)
+
+        # Only sub-requests that were rate limited or hit a transient error are sent again
+        retry = []
+        for position, index in enumerate(pending):
+            status_code, payload = results.get(position, (None, {}))
+            if status_code == 200:
+                messages[index] = payload
+            elif status_code == 404:
+                # Message was deleted between listing and fetching
+                messages[index] = None
+            elif status_code is None or is_retryable_status(status_code, payload):
+                retry.append(index)
+            else:
+                raise requests.HTTPError(f'{status_code} error fetching message {message_ids[index]}: {payload}')
+
+        if retry and attempt >= get_max_retries():
+            raise requests.HTTPError(f'Batch fetch failed for {len(retry)} message(s) after {attempt} retries')
+
+        if retry:
+            delay = get_backoff_delay(attempt)
+            print(f'{len(retry)} message(s) in batch were rate limited. Retrying in {delay:.1f}s...')
+            time.sleep(delay)
+            attempt += 1
+
+        pending = retry
+
+    return messages
+
+def batch_get_messages(user_id, message_ids: list, params=None):
+    """
+    Fetch messages through Gmail's batch endpoint, packing up to GMAIL_BATCH_SIZE (max 100) gets per request
+
+    user_id: str
+        User's email address
+
+    message_ids: list
+        Gmail message IDs to fetch
+
+    params: list | dict
+        Query parameters applied to every messages.get call (e.g. format, fields)
+
+    Returns the message resources in the same order as message_ids, with None for messages that no longer exist.
+    """
+    batch_size = get_batch_size()
+
+    messages = []
+    for start in range(0, len(message_ids), batch_size):
+        messages.extend(_batch_get_chunk(user_id, message_ids[start:start + batch_size], params))
+
+    return messages
@@ -0,0 +1,142 @@
+from html.parser import HTMLParser
+import base64
+import os
+
+# Elements whose text never shows up in a rendered email
+NON_TEXT_TAGS = {'script', 'style', 'template'}
+
+def _get_html_to_text_method():
+    return os.environ.get('GMAIL_HTML_TO_TEXT', 'fast')
+
+class _TextExtractor(HTMLParser):
+    """
+    Collects the stripped, non-empty text nodes of an HTML document, the same strings BeautifulSoup's
+    get_text(separator='\n', strip=True) joins together
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.strings = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in NON_TEXT_TAGS:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in NON_TEXT_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            data = data.strip()
+            if data:
+                self.strings.append(data)
+
+def html_to_text(html, method=None):
+    """
+    Convert an HTML email body to plain text, one text node per line
+
+    html: str
+        HTML document
+
+    method: str
+        'fast' - single pass with the standard library's html.parser (no tree is built)
+        'bs4' - BeautifulSoup with html.parser, as used previously
+        Defaults to GMAIL_HTML_TO_TEXT, or 'fast'
+    """
+    method = method or _get_html_to_text_method()
+
+    if method == 'bs4':
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, 'html.parser')
+        return soup.get_text(separator='\n', strip=True)
+
+    if method != 'fast':
+        raise ValueError(f'Unknown HTML to text method "{method}". Expected "fast" or "bs4"')
+
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return '\n'.join(extractor.strings)
+
+def get_message_headers(message_metadata):
+    """
+    Index a message's headers once into {lowercased header name: value}
+    """
+    return {header['name'].lower(): header['value'] for header in message_metadata.get('payload', {}).get('headers', [])}
+
+def extract_email_body(payload, parse_method='text'):
+    """
+    Extracts the email body in the specified format ('text' or 'html').
+    If only HTML is found but 'text' is requested, it will strip the HTML.
+    """
+    def decode_base64(data):
+        return base64.urlsafe_b64decode(data.encode('utf-8')).decode('utf-8')
+
+    def find_part(parts, mime_type):
+        for part in parts:
+            if part.get('mimeType') == mime_type and 'data' in part.get('body', {}):
+                return decode_base64(part['body']['data'])
+            elif 'parts' in part:
+                result = find_part(part['parts'], mime_type)
+                if result:
+                    return result
+        return None
+
+    # Step 1: Try to find the requested format
+    mime_target = 'text/plain' if parse_method == 'text' else 'text/html'
+    body = None
+
+    if 'parts' in payload:
+        body = find_part(payload['parts'], mime_target)
+    elif payload.get('mimeType') == mime_target and 'data' in payload.get('body', {}):
+        body = decode_base64(payload['body']['data'])
+
+    # Step 2: Fallback - if user wants plain text but only HTML is found
+    if not body and parse_method == 'text':
+        # Try to find HTML and strip it
+        html_body = None
+        if 'parts' in payload:
+            html_body = find_part(payload['parts'], 'text/html')
+        elif payload.get('mimeType') == 'text/html' and 'data' in payload.get('body', {}):
+            html_body = decode_base64(payload['body']['data'])
+
+        if html_body:
+            return html_to_text(html_body)
+
+    return body or f"[No {parse_method} body found]"
+
+class EmailBody:
+    """
+    Body of a fetched message, decoded from its payload only the first time it is read
+
+    payload: dict
+        Message payload as returned by messages.get with format=full
+
+    parse_method: str
+        'text' or 'html', as in extract_email_body
+    """
+    __slots__ = ('_payload', '_parse_method', '_text')
+
+    def __init__(self, payload, parse_method='text'):
+        self._payload = payload
+        self._parse_method = parse_method
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = extract_email_body(self._payload, self._parse_method)
+            # The decoded text is all that is needed from here on
+            self._payload = None
+        return self._text
+
+    @property
+    def is_decoded(self):
+        return self._text is not None
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"EmailBody({'decoded' if self.is_decoded else 'not decoded'}, parse_method={self._parse_method!r})"
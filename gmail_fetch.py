@@ -0,0 +1,280 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import timedelta, timezone
+from itertools import islice
+import os
+from google_api_client import google_request
+from gmail_batch import batch_get_messages, get_batch_size
+from gmail_message_cache import is_cacheable_profile, get_cached_messages, store_messages
+
+base_url = 'https://gmail.googleapis.com/gmail/v1/users/'
+
+# MIME part fields the attachments profile keeps; inline body/data is left out
+ATTACHMENT_PART_FIELDS = 'partId,mimeType,filename,headers,body/attachmentId,body/size'
+
+# Field masks cannot recurse, so the part mask is repeated this many levels below the payload. That covers
+# multipart/mixed > alternative > related > text/html; parts nested any deeper come back unmasked
+ATTACHMENT_MASK_DEPTH = 4
+
+def _attachment_parts_mask(depth):
+    mask = 'parts'
+    for _ in range(depth):
+        mask = f'parts({ATTACHMENT_PART_FIELDS},{mask})'
+    return mask
+
+# Fetch profiles describing how much of each message a caller needs. Field masks keep the API from
+# sending anything else; 'ids' needs no messages.get call at all
+FETCH_PROFILES = {
+    'ids': None,
+    'metadata': {
+        'format': 'metadata',
+        'metadataHeaders': ['From', 'Subject', 'Date'],
+        'fields': 'id,threadId,labelIds,payload/headers',
+    },
+    'attachments': {
+        'format': 'full',
+        'fields': f'id,threadId,labelIds,payload({ATTACHMENT_PART_FIELDS},{_attachment_parts_mask(ATTACHMENT_MASK_DEPTH)})',
+    },
+    'full': {
+        'format': 'full',
+        'fields': 'id,threadId,labelIds,payload',
+    },
+}
+
+def _get_fetch_concurrency():
+    return max(1, int(os.environ.get('GMAIL_FETCH_CONCURRENCY', 4)))
+
+def imap_bounded(func, items, max_workers=None):
+    """
+    Lazily apply func to every item on a thread pool of at most max_workers threads (GMAIL_FETCH_CONCURRENCY
+    by default), yielding results in the same order as items. Items are pulled from the iterable only as
+    workers free up, so an unbounded generator can be consumed with flat memory
+    """
+    max_workers = max_workers or _get_fetch_concurrency()
+
+    if max_workers == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for item in items:
+            in_flight.append(executor.submit(func, item))
+            if len(in_flight) >= max_workers:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def split_workers(max_workers=None):
+    """
+    Split one concurrency budget (GMAIL_FETCH_CONCURRENCY by default) between a fetch stage and a second
+    imap_bounded stage fed by it, so the two pools never have more than max_workers requests in flight
+    between them
+
+    Returns (fetch workers, second stage workers).
+    """
+    max_workers = max_workers or _get_fetch_concurrency()
+
+    # With a single worker both stages run inline on the calling thread, one request at a time
+    if max_workers == 1:
+        return 1, 1
+
+    fetch_workers = max_workers // 2
+    return fetch_workers, max_workers - fetch_workers
+
+def map_bounded(func, items, max_workers=None):
+    """
+    Eager version of imap_bounded returning a list
+    """
+    return list(imap_bounded(func, items, max_workers))
+
+def _chunked(items, size):
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def iter_email_message_ids(user_id, current_date, days_lookback = None, label_ids: str|list = None, filter_query = None, include_spam_trash_boxes = False, max_results: int = 500):
+    """
+    Lazily list messages matching the date range and filters, following nextPageToken page by page
+
+    user_id: str
+        User's email address
+
+    current_date: datetime
+        Current date to start filtering for emails
+
+    days_lookback: int
+        Number of days from current_date to lookback and filter emails
+
+    label_ids: list
+        Label IDs every listed message must carry
+
+    filter_query: str
+        Additional Gmail search query
+
+    include_spam_trash_boxes: bool
+        Whether to list out emails from the Spam and Trash mailboxes
+
+    max_results: int
+        Page size (Gmail allows up to 500)
+
+    Yields message stubs ({'id': ..., 'threadId': ...}) as each page arrives.
+    """
+    url = f'{base_url}{user_id}/messages'
+    params = [('maxResults', max_results)]
+
+    if include_spam_trash_boxes:
+        params.append(('includeSpamTrash', True))
+
+    # Filter emails by date range
+    if days_lookback:
+        start_dt = (current_date - timedelta(days=days_lookback))
+    else:
+        start_dt = (current_date - timedelta(days=1))
+
+    end_dt = (current_date + timedelta(days=1))
+
+    # Convert to UTC timestamps
+    start_ts = int(start_dt.astimezone(timezone.utc).timestamp())
+    end_ts = int(end_dt.astimezone(timezone.utc).timestamp())
+
+    print(f"Filtering range between {start_dt.strftime('%d/%m/%Y %H:%M')} to {end_dt.strftime('%d/%m/%Y %H:%M')}\n")
+
+    q = f"after:{start_ts} before:{end_ts}"
+    if filter_query:
+        q += f' {filter_query}'
+    params.append(('q', q))
+
+    if isinstance(label_ids, list) and len(label_ids) > 0:
+        for label in label_ids:
+            params.append(('labelIds', label))
+
+    page_token = None
+    while True:
+        page_params = params + [('pageToken', page_token)] if page_token else params
+
+        try:
+            response = google_request('GET', url, params=page_params)
+            response.raise_for_status()
+            response_data = response.json()
+
+        except Exception as e:
+            print('An unexpected error occured on attempting to retrieve email IDs.')
+            raise e
+
+        yield from response_data.get('messages', [])
+
+        page_token = response_data.get('nextPageToken')
+        if not page_token:
+            break
+
+def list_email_message_ids(user_id, current_date, days_lookback = None, label_ids: str|list = None, filter_query = None, include_spam_trash_boxes = False, max_results: int = 500):
+    """
+    Eager version of iter_email_message_ids returning every matching message stub
+    """
+    return list(iter_email_message_ids(user_id, current_date, days_lookback, label_ids, filter_query, include_spam_trash_boxes, max_results))
+
+def get_fetch_params(profile, metadata_headers=None):
+    """
+    Build messages.get query parameters for a fetch profile
+
+    profile: str
+        One of 'ids', 'metadata', 'attachments' or 'full'
+
+    metadata_headers: list
+        Headers to return for the 'metadata' profile. Defaults to From, Subject and Date
+    """
+    if profile not in FETCH_PROFILES:
+        raise ValueError(f'Unknown fetch profile "{profile}". Expected one of {list(FETCH_PROFILES)}')
+
+    settings = FETCH_PROFILES[profile]
+    if settings is None:
+        return None
+
+    params = [('format', settings['format']), ('fields', settings['fields'])]
+    if settings['format'] == 'metadata':
+        for header in metadata_headers or settings['metadataHeaders']:
+            params.append(('metadataHeaders', header))
+
+    return params
+
+def _get_message(user_id, message_id, params):
+    url = f"{base_url}{user_id}/messages/{message_id}"
+    response = google_request('GET', url, params=params)
+
+    # Message was deleted between listing and fetching
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+def iter_fetch_messages(user_id, message_ids, params=None, use_batch=True, max_workers=None, profile=None, use_cache=True):
+    """
+    Fetch message resources concurrently, yielding them in the same order as message_ids. Messages deleted
+    since they were listed are skipped
+
+    user_id: str
+        User's email address
+
+    message_ids: iterable
+        Gmail message IDs to fetch. May be a generator; fetching starts as soon as the first batch is available
+
+    params: list | dict
+        Query parameters applied to every messages.get call (e.g. format, fields)
+
+    use_batch: bool
+        Whether to group gets into batch requests (which are then sent in parallel) or send one GET per message
+
+    max_workers: int
+        Maximum number of requests in flight. Defaults to GMAIL_FETCH_CONCURRENCY
+
+    profile: str
+        Fetch profile used to build params when none are given (see FETCH_PROFILES)
+
+    use_cache: bool
+        Whether to serve messages from, and save them to, the local message cache. Only applies when
+        fetching by profile; cached messages do not carry labelIds
+    """
+    if profile == 'ids':
+        for message_id in message_ids:
+            yield {'id': message_id}
+        return
+
+    cacheable = use_cache and params is None and is_cacheable_profile(profile)
+
+    if params is None and profile:
+        params = get_fetch_params(profile)
+
+    def fetch_chunk(chunk):
+        cached = get_cached_messages(user_id, chunk, profile) if cacheable else {}
+        missing = [message_id for message_id in chunk if message_id not in cached]
+
+        # Only messages never seen before go to the network
+        if not missing:
+            fetched = []
+        elif use_batch:
+            fetched = batch_get_messages(user_id, missing, params)
+        else:
+            fetched = [_get_message(user_id, message_id, params) for message_id in missing]
+
+        if cacheable:
+            store_messages(user_id, [message for message in fetched if message is not None], profile)
+
+        fetched_by_id = dict(zip(missing, fetched))
+        return [cached[message_id] if message_id in cached else fetched_by_id[message_id] for message_id in chunk]
+
+    # Without batching every message is its own request, so each one is a separate unit of work
+    chunks = _chunked(message_ids, get_batch_size() if use_batch else 1)
+    for chunk_messages in imap_bounded(fetch_chunk, chunks, max_workers):
+        yield from (message for message in chunk_messages if message is not None)
+
+def fetch_messages(user_id, message_ids, params=None, use_batch=True, max_workers=None, profile=None, use_cache=True):
+    """
+    Eager version of iter_fetch_messages returning a list
+    """
+    return list(iter_fetch_messages(user_id, message_ids, params, use_batch, max_workers, profile, use_cache))
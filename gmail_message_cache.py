@@ -0,0 +1,133 @@
+import threading
+import sqlite3
+import json
+import time
+import os
+
+# A cached message fetched with a richer profile can also answer requests for a leaner one
+PROFILE_COVERAGE = {
+    'metadata': ('metadata', 'attachments', 'full'),
+    'attachments': ('attachments', 'full'),
+    'full': ('full',),
+}
+
+_write_lock = threading.Lock()
+
+def _get_cache_db_path():
+    return os.environ.get('GMAIL_CACHE_DB', 'gmail_state.db')
+
+def _get_cache_max_bytes():
+    return int(os.environ.get('GMAIL_CACHE_MAX_BYTES', 100 * 1024 * 1024))
+
+def _connect_cache_db():
+    conn = sqlite3.connect(_get_cache_db_path(), timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS message_cache (
+            user_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            profile TEXT NOT NULL,
+            message TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            last_accessed REAL NOT NULL,
+            PRIMARY KEY (user_id, message_id, profile)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS message_cache_last_accessed ON message_cache (last_accessed)")
+    return conn
+
+def is_cacheable_profile(profile):
+    return profile in PROFILE_COVERAGE
+
+def get_cached_messages(user_id, message_ids: list, profile):
+    """
+    Look up cached message resources for the given IDs
+
+    user_id: str
+        User's email address
+
+    message_ids: list
+        Gmail message IDs to look up
+
+    profile: str
+        Fetch profile the caller needs; entries stored under a richer profile also qualify
+
+    Returns {message_id: message resource} for the IDs found. Hits are marked as recently used.
+    """
+    if not message_ids:
+        return {}
+
+    profiles = PROFILE_COVERAGE[profile]
+    id_placeholders = ', '.join('?' * len(message_ids))
+    profile_placeholders = ', '.join('?' * len(profiles))
+
+    conn = _connect_cache_db()
+    try:
+        rows = conn.execute(f"""
+            SELECT message_id, profile, message
+            FROM message_cache
+            WHERE user_id = ? AND message_id IN ({id_placeholders}) AND profile IN ({profile_placeholders})
+        """, (user_id, *message_ids, *profiles)).fetchall()
+
+        cached = {}
+        hits = []
+        for message_id, cached_profile, message in rows:
+            if message_id not in cached:
+                cached[message_id] = json.loads(message)
+                hits.append((time.time(), user_id, message_id, cached_profile))
+
+        if hits:
+            with _write_lock:
+                conn.executemany("""
+                    UPDATE message_cache SET last_accessed = ?
+                    WHERE user_id = ? AND message_id = ? AND profile = ?
+                """, hits)
+                conn.commit()
+    finally:
+        conn.close()
+
+    return cached
+
+def store_messages(user_id, messages: list, profile):
+    """
+    Cache message resources fetched with the given profile, then evict least recently used entries
+    until the cache fits within GMAIL_CACHE_MAX_BYTES
+
+    Gmail message IDs never change content, so entries need no invalidation. Labels do change,
+    so labelIds are not cached.
+    """
+    if not messages:
+        return
+
+    now = time.time()
+    rows = []
+    for message in messages:
+        serialized = json.dumps({key: value for key, value in message.items() if key != 'labelIds'})
+        rows.append((user_id, message['id'], profile, serialized, len(serialized), now))
+
+    with _write_lock:
+        conn = _connect_cache_db()
+        try:
+            conn.executemany("""
+                INSERT OR REPLACE INTO message_cache (user_id, message_id, profile, message, size_bytes, last_accessed)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            _evict_least_recently_used(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+def _evict_least_recently_used(conn):
+    max_bytes = _get_cache_max_bytes()
+    total_bytes = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM message_cache").fetchone()[0]
+    if total_bytes <= max_bytes:
+        return
+
+    evict = []
+    for rowid, size_bytes in conn.execute("SELECT rowid, size_bytes FROM message_cache ORDER BY last_accessed"):
+        if total_bytes <= max_bytes:
+            break
+        evict.append((rowid,))
+        total_bytes -= size_bytes
+
+    conn.executemany("DELETE FROM message_cache WHERE rowid = ?", evict)
+    print(f'Evicted {len(evict)} message(s) from the local message cache')
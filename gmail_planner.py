@@ -0,0 +1,188 @@
+from gmail_fetch import iter_email_message_ids, iter_fetch_messages
+from gmail_sync import list_incremental_message_ids, message_matches_filters
+from relocate_emails_to_folders import resolve_label_id
+
+# Profiles ordered from leanest to richest
+PROFILE_ORDER = ['ids', 'metadata', 'attachments', 'full']
+
+# Leanest profile carrying the labels and headers consumers are matched on
+MATCH_PROFILE = 'metadata'
+
+def mailbox_consumer(name, label_ids: list = [], subject_filter = [], email_filter = [], profile = 'metadata', add_labels: list = [], remove_labels: list = [], exclude_labels: list = []):
+    """
+    Describe one consumer of a combined mailbox scan
+
+    name: str
+        Key the consumer's share of messages is returned under
+
+    label_ids: list
+        Label names every message for this consumer must carry e.g. ['INBOX']
+
+    subject_filter: list
+        Subject substrings, any of which a message must contain
+
+    email_filter: list
+        Sender addresses, any of which a message must come from
+
+    profile: str
+        How much of each message the consumer needs ('ids', 'metadata', 'attachments' or 'full'). An 'ids'
+        consumer's share holds just {'id'} for each message
+
+    add_labels / remove_labels: list
+        Label names the consumer will add to or remove from its messages once the scan is done
+        (e.g. a move into a folder). Applied to the local view of each message so later consumers
+        see the mailbox as it will be after the move
+
+    exclude_labels: list
+        Label names a message must not carry e.g. a processed label. Excluded server-side in the query
+    """
+    if profile not in PROFILE_ORDER:
+        raise ValueError(f'Unknown consumer profile "{profile}". Expected one of {PROFILE_ORDER}')
+
+    return {
+        'name': name,
+        'label_ids': label_ids,
+        'subject_filter': subject_filter,
+        'email_filter': email_filter,
+        'profile': profile,
+        'add_labels': add_labels,
+        'remove_labels': remove_labels,
+        'exclude_labels': exclude_labels,
+    }
+
+def _search_label(label_name):
+    # Gmail search refers to labels by name, lowercased with spaces and slashes replaced by hyphens
+    return 'label:' + label_name.lower().replace(' ', '-').replace('/', '-')
+
+def _consumer_query(consumer):
+    clauses = [_search_label(label) for label in consumer['label_ids']]
+    clauses += ['-' + _search_label(label) for label in consumer['exclude_labels']]
+
+    if consumer['email_filter']:
+        clauses.append('(' + ' OR '.join(f'from:{email}' for email in consumer['email_filter']) + ')')
+
+    if consumer['subject_filter']:
+        clauses.append('(' + ' OR '.join(f'subject:"{subject.strip()}"' for subject in consumer['subject_filter']) + ')')
+
+    return '(' + ' '.join(clauses) + ')' if clauses else ''
+
+def build_combined_query(consumers: list):
+    """
+    OR together the search query of every consumer, so a single listing covers all of them
+
+    Returns an empty string if any consumer is unrestricted, since that consumer needs every message anyway.
+    """
+    queries = [_consumer_query(consumer) for consumer in consumers]
+    if not all(queries):
+        return ''
+    return queries[0] if len(queries) == 1 else '(' + ' OR '.join(queries) + ')'
+
+def scan_mailbox(user_id, current_date, days_lookback, consumers: list, include_spam_trash_boxes = False, use_batch = True, max_workers = None, incremental = False):
+    """
+    Serve several consumers from one listing over the mailbox, instead of a separate scan per consumer.
+    Listed messages are fetched once at 'metadata' to tell the consumers apart; only the messages taken by
+    a consumer with a richer profile are fetched again, at that consumer's profile
+
+    user_id: str
+        User's email address
+
+    current_date: datetime
+        Current date to start filtering for emails
+
+    days_lookback: int
+        Number of days from current_date to lookback and filter emails
+
+    consumers: list
+        Consumers built with mailbox_consumer. Each message is offered to the consumers in this order
+
+    include_spam_trash_boxes: bool
+        Whether to list out emails from the Spam and Trash mailboxes
+
+    use_batch: bool
+        Whether to fetch messages through Gmail's batch endpoint
+
+    max_workers: int
+        Maximum number of concurrent message requests. Defaults to GMAIL_FETCH_CONCURRENCY
+
+    incremental: bool
+        Only scan messages that arrived since the last incremental run of this set of consumers, falling
+        back to the days_lookback window when there is no valid checkpoint yet
+
+    Returns ({consumer name: [message resources]}, sync checkpoint). Each consumer's filters are checked
+    locally against the fetched labels and headers, so a message listed for one consumer is never handed to
+    another by mistake. The sync checkpoint is {'scope', 'history_id'} (None unless incremental) and is not
+    saved here: pass it to save_checkpoint once every consumer has finished with its messages, so a failed
+    run scans the same messages again.
+    """
+    names = [consumer['name'] for consumer in consumers]
+    if len(set(names)) != len(names):
+        raise ValueError(f'Consumer names must be unique, got {names}')
+
+    filter_query = build_combined_query(consumers)
+
+    # Messages carry label IDs, consumers name their labels; resolve every name once up front. A label that
+    # does not exist yet resolves to None, which no fetched message carries
+    label_names = {label for consumer in consumers for label in consumer['label_ids'] + consumer['add_labels'] + consumer['remove_labels'] + consumer['exclude_labels']}
+    label_id_lookup = {label: resolve_label_id(user_id, label) for label in label_names}
+
+    def list_message_ids():
+        return (message['id'] for message in iter_email_message_ids(user_id=user_id, current_date=current_date, days_lookback=days_lookback, include_spam_trash_boxes=include_spam_trash_boxes, filter_query=filter_query))
+
+    sync_checkpoint = None
+    if incremental:
+        # Each consumer needs all of its labels, so one of them is enough to narrow the history; an
+        # unlabelled consumer needs the whole mailbox's history
+        sync_labels = [consumer['label_ids'][0] if consumer['label_ids'] else None for consumer in consumers]
+        sync_labels = None if None in sync_labels else list(dict.fromkeys(sync_labels))
+
+        sync_scope = f'scan_mailbox|{filter_query}|{include_spam_trash_boxes}'
+        message_ids, history_id = list_incremental_message_ids(user_id, sync_scope, list_message_ids, sync_labels)
+        sync_checkpoint = {'scope': sync_scope, 'history_id': history_id}
+    else:
+        message_ids = list_message_ids()
+
+    shares = {name: [] for name in names}
+
+    # A lone ids-only consumer gets exactly what the listing query matched, so nothing needs fetching.
+    # History results are unfiltered and still have to be checked below
+    if len(consumers) == 1 and consumers[0]['profile'] == 'ids' and not incremental:
+        shares[names[0]] = [{'id': message_id} for message_id in message_ids]
+        message_ids = []
+
+    # Labels decide which consumer a message belongs to, and the message cache does not keep them
+    messages = iter_fetch_messages(user_id, message_ids, use_batch=use_batch, max_workers=max_workers, profile=MATCH_PROFILE, use_cache=False)
+
+    for message in messages:
+        labels = set(message.get('labelIds', []))
+
+        for consumer in consumers:
+            if not all(label_id_lookup[label] in labels for label in consumer['label_ids']):
+                continue
+            if any(label_id_lookup[label] in labels for label in consumer['exclude_labels']):
+                continue
+            if not message_matches_filters(message, consumer['subject_filter'], consumer['email_filter']):
+                continue
+
+            shares[consumer['name']].append(message)
+
+            # Reflect this consumer's pending label changes for the consumers after it
+            labels |= {label_id_lookup[label] for label in consumer['add_labels']}
+            labels -= {label_id_lookup[label] for label in consumer['remove_labels']}
+
+    for consumer in consumers:
+        share = shares[consumer['name']]
+
+        if consumer['profile'] == 'ids':
+            shares[consumer['name']] = [{'id': message['id']} for message in share]
+
+        elif PROFILE_ORDER.index(consumer['profile']) > PROFILE_ORDER.index(MATCH_PROFILE):
+            # Upgrade just this consumer's messages. Their labels are already known, so the cache can serve
+            # the content and the fetched labels are carried over
+            message_labels = {message['id']: message.get('labelIds', []) for message in share}
+            richer_messages = iter_fetch_messages(user_id, list(message_labels), use_batch=use_batch, max_workers=max_workers, profile=consumer['profile'])
+            shares[consumer['name']] = [{**message, 'labelIds': message_labels[message['id']]} for message in richer_messages]
+
+    for name, share in shares.items():
+        print(f'{len(share)} message(s) found for {name}')
+
+    return shares, sync_checkpoint
@@ -0,0 +1,171 @@
+import sqlite3
+import os
+from google_api_client import google_request
+from relocate_emails_to_folders import resolve_label_id
+from gmail_body import get_message_headers
+
+base_url = 'https://gmail.googleapis.com/gmail/v1/users/'
+
+def _get_state_db_path():
+    return os.environ.get('GMAIL_STATE_DB', 'gmail_state.db')
+
+def _connect_state_db():
+    conn = sqlite3.connect(_get_state_db_path())
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_checkpoints (
+            user_id TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            history_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, scope)
+        )
+    """)
+    return conn
+
+def load_checkpoint(user_id, scope):
+    conn = _connect_state_db()
+    try:
+        row = conn.execute("""
+            SELECT history_id
+            FROM sync_checkpoints
+            WHERE user_id = ? AND scope = ?
+        """, (user_id, scope)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def save_checkpoint(user_id, scope, history_id):
+    conn = _connect_state_db()
+    try:
+        conn.execute("""
+            INSERT INTO sync_checkpoints (user_id, scope, history_id, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id, scope) DO UPDATE SET
+                history_id = excluded.history_id,
+                updated_at = excluded.updated_at
+        """, (user_id, scope, history_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_current_history_id(user_id):
+    url = f'{base_url}{user_id}/profile'
+    response = google_request('GET', url, params={'fields': 'historyId'})
+    response.raise_for_status()
+    return response.json()['historyId']
+
+def get_sync_label(label_ids):
+    """
+    History can only be filtered on a single label; pick it out of a retrieve_* label_ids argument. Listed
+    messages must carry every label, so any one of them narrows the history without losing messages
+    """
+    if isinstance(label_ids, str):
+        return label_ids
+    if isinstance(label_ids, list) and label_ids:
+        return label_ids[0]
+    return None
+
+def list_history_message_ids(user_id, start_history_id, label_id=None):
+    """
+    List IDs of messages added (or given label_id) since start_history_id, in the order they appeared
+
+    Returns None when Gmail no longer holds history that far back, in which case a full scan is needed.
+    """
+    url = f'{base_url}{user_id}/history'
+    params = [
+        ('startHistoryId', start_history_id),
+        ('historyTypes', 'messageAdded'),
+        ('historyTypes', 'labelAdded'),
+        ('fields', 'history(messagesAdded/message/id,labelsAdded/message/id),nextPageToken'),
+        ('maxResults', 500),
+    ]
+    if label_id:
+        params.append(('labelId', label_id))
+
+    message_ids = {}
+    page_token = None
+    while True:
+        page_params = params + [('pageToken', page_token)] if page_token else params
+        response = google_request('GET', url, params=page_params)
+
+        # History records are only kept for a limited time; an expired startHistoryId returns 404
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        response_data = response.json()
+
+        for record in response_data.get('history', []):
+            for change in record.get('messagesAdded', []) + record.get('labelsAdded', []):
+                message_ids.setdefault(change['message']['id'], None)
+
+        page_token = response_data.get('nextPageToken')
+        if not page_token:
+            break
+
+    return list(message_ids)
+
+def list_incremental_message_ids(user_id, scope, fallback, label_names: list = None):
+    """
+    Find IDs of messages that arrived since the last completed sync of this scope
+
+    user_id: str
+        User's email address
+
+    scope: str
+        Key identifying the consumer (e.g. function, label and query), each with its own checkpoint
+
+    fallback: callable
+        Returns an iterable of message IDs from a full windowed scan. Used when there is no checkpoint
+        yet or it has expired
+
+    label_names: list
+        Only report messages added to, or labelled with, one of these labels (names or label IDs). History
+        filters on one label per request, so each label is listed separately. None reports every message
+        in the mailbox
+
+    Returns (message IDs, history ID to checkpoint). The checkpoint is not advanced here; call
+    save_checkpoint(user_id, scope, history_id) once every message has been fully handled, so a failed
+    run picks the same messages up again.
+    """
+    checkpoint = load_checkpoint(user_id, scope)
+
+    # Taken before listing so that mail arriving mid-run is picked up next time
+    latest_history_id = get_current_history_id(user_id)
+
+    if not checkpoint:
+        print('No sync checkpoint found. Running a full scan...')
+        return fallback(), latest_history_id
+
+    message_ids = {}
+    for label_name in label_names or [None]:
+        label_id = resolve_label_id(user_id, label_name)
+
+        # Resolved now, so a label created since the checkpoint is found; one that still does not exist
+        # cannot be on any message. Never fall back to the unfiltered history for it
+        if label_name is not None and label_id is None:
+            continue
+
+        label_message_ids = list_history_message_ids(user_id, checkpoint, label_id)
+        if label_message_ids is None:
+            print('Sync checkpoint has expired. Falling back to a full scan...')
+            return fallback(), latest_history_id
+
+        for message_id in label_message_ids:
+            message_ids.setdefault(message_id, None)
+
+    print(f'{len(message_ids)} new message(s) since last sync')
+    return list(message_ids), latest_history_id
+
+def message_matches_filters(message_metadata, subject_filter=[], email_filter=[]):
+    """
+    Client-side equivalent of the from:/subject: query used in windowed scans, for messages found via history
+    """
+    headers = get_message_headers(message_metadata)
+
+    if email_filter and not any(email.lower() in headers.get('from', '').lower() for email in email_filter):
+        return False
+
+    if subject_filter and not any(subject.strip().lower() in headers.get('subject', '').lower() for subject in subject_filter):
+        return False
+
+    return True
@@ -0,0 +1,207 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import threading
+import random
+import time
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from get_access_token import get_user_access_token
+
+# Responses worth retrying: rate limiting and transient server-side failures
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+RETRYABLE_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+# A request that creates something may have been carried out even though its response never arrived, so
+# it is only retried when the server cannot have acted on it: the connection was never made, or the call
+# was rejected by rate limiting
+NON_IDEMPOTENT_RETRYABLE_EXCEPTIONS = (requests.exceptions.ConnectTimeout,)
+
+# One pooled session per API host so TLS connections are kept alive between calls
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _get_pool_size():
+    return int(os.environ.get('GOOGLE_API_POOL_SIZE', 10))
+
+def _get_default_timeout():
+    connect_timeout = float(os.environ.get('GOOGLE_API_CONNECT_TIMEOUT', 10))
+    read_timeout = float(os.environ.get('GOOGLE_API_READ_TIMEOUT', 60))
+    return (connect_timeout, read_timeout)
+
+def get_max_retries():
+    """
+    Number of retries after the first attempt for any Google API call (GOOGLE_API_MAX_RETRIES)
+    """
+    return int(os.environ.get('GOOGLE_API_MAX_RETRIES', 5))
+
+def _get_backoff_base():
+    return float(os.environ.get('GOOGLE_API_BACKOFF_BASE', 1))
+
+def _get_backoff_max():
+    return float(os.environ.get('GOOGLE_API_BACKOFF_MAX', 60))
+
+def is_retryable_status(status_code, payload=None, idempotent=True):
+    """
+    Whether a response with this status code and parsed JSON body is worth retrying. Also used for the
+    sub-responses of a batch request, which never pass through google_request's own retry loop
+    """
+    if status_code == 429:
+        return True
+    if idempotent and status_code in RETRYABLE_STATUS_CODES:
+        return True
+
+    # Drive and Gmail report per-user quota exhaustion as a 403 with a rate limit reason
+    if status_code == 403 and isinstance(payload, dict):
+        errors = payload.get('error', {}).get('errors', [])
+        return any(error.get('reason') in RATE_LIMIT_REASONS for error in errors)
+
+    return False
+
+def _is_retryable_response(response, idempotent=True):
+    payload = None
+    if response.status_code == 403:
+        try:
+            payload = response.json()
+        except ValueError:
+            return False
+    return is_retryable_status(response.status_code, payload, idempotent)
+
+def _get_retry_after(response):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if not retry_after:
+        return None
+
+    # Retry-After is either a number of seconds or an HTTP date
+    if retry_after.strip().isdigit():
+        return float(retry_after)
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def get_backoff_delay(attempt, response=None):
+    retry_after = _get_retry_after(response)
+    if retry_after is not None:
+        return min(retry_after, _get_backoff_max())
+
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(_get_backoff_max(), _get_backoff_base() * 2 ** attempt))
+
+def _get_rewindable_streams(kwargs):
+    # File objects sent as the body must be rewound before a request is re-sent
+    streams = []
+    candidates = [kwargs.get('data')]
+    files = kwargs.get('files') or {}
+    for value in (files.values() if isinstance(files, dict) else files):
+        candidates.extend(value if isinstance(value, (tuple, list)) else [value])
+
+    for candidate in candidates:
+        if hasattr(candidate, 'seek') and hasattr(candidate, 'tell'):
+            streams.append((candidate, candidate.tell()))
+    return streams
+
+def get_session(url):
+    """
+    Return the shared session for the host of the given URL, creating it on first use
+
+    url: str
+        Any URL on the host (e.g. https://gmail.googleapis.com/...)
+    """
+    host = urlsplit(url).netloc
+
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            pool_size = _get_pool_size()
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            _sessions[host] = session
+
+    return session
+
+def google_request(method, url, access_token=None, headers=None, timeout=None, max_retries=None, idempotent=None, **kwargs):
+    """
+    Send an authenticated request to a Google API through the pooled session for its host
+
+    method: str
+        HTTP method e.g. 'GET', 'POST', 'DELETE'
+
+    url: str
+        Full request URL
+
+    access_token: str
+        Token to authenticate with. Defaults to the token of the EMAIL account
+
+    headers: dict
+        Extra headers to send. The Authorization header is added automatically
+
+    timeout: float | tuple
+        Connect/read timeout in seconds. Defaults to GOOGLE_API_CONNECT_TIMEOUT and GOOGLE_API_READ_TIMEOUT
+
+    max_retries: int
+        Retry limit for this request. Defaults to GOOGLE_API_MAX_RETRIES; pass 0 for callers that handle
+        failures themselves
+
+    idempotent: bool
+        Whether sending the request twice is harmless. Defaults to True for every method but POST. A
+        non-idempotent request (sending an email, creating a file or folder) is only retried on connect
+        timeouts and rate limiting, never on 5xx responses, read timeouts or dropped connections, since
+        the server may already have carried it out
+
+    kwargs:
+        Passed through to requests (params, json, data, files, stream, ...)
+
+    Rate-limited (429, quota 403) and, for idempotent requests, 5xx responses and connection failures are
+    retried up to max_retries times with exponential backoff and jitter, honouring any Retry-After header.
+    The final response is returned as-is, so callers still check its status code.
+    """
+    session = get_session(url)
+    timeout = timeout or _get_default_timeout()
+    max_retries = get_max_retries() if max_retries is None else max_retries
+    idempotent = method.upper() != 'POST' if idempotent is None else idempotent
+    retryable_exceptions = RETRYABLE_EXCEPTIONS if idempotent else NON_IDEMPOTENT_RETRYABLE_EXCEPTIONS
+    streams = _get_rewindable_streams(kwargs)
+    token = access_token or get_user_access_token()
+    refreshed = False
+    attempt = 0
+
+    while True:
+        for stream, position in streams:
+            stream.seek(position)
+
+        request_headers = {'Authorization': f'Bearer {token}'}
+        if headers:
+            request_headers.update(headers)
+
+        try:
+            response = session.request(method, url, headers=request_headers, timeout=timeout, **kwargs)
+        except retryable_exceptions as e:
+            if attempt >= max_retries:
+                raise e
+            delay = get_backoff_delay(attempt)
+            print(f'{method} {url} failed ({type(e).__name__}). Retrying in {delay:.1f}s...')
+        else:
+            # Token may have been revoked or expired early; refresh it once and retry
+            if response.status_code == 401 and not access_token and not refreshed:
+                response.close()
+                token = get_user_access_token(force_refresh=True)
+                refreshed = True
+                continue
+
+            if not _is_retryable_response(response, idempotent) or attempt >= max_retries:
+                return response
+
+            delay = get_backoff_delay(attempt, response)
+            print(f'{method} {url} returned {response.status_code}. Retrying in {delay:.1f}s...')
+            response.close()
+
+        time.sleep(delay)
+        attempt += 1
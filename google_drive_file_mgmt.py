@@ -1,14 +1,17 @@
 # from google.auth.transport.requests import Request
 from datetime import datetime, timedelta
+import threading
+import hashlib
+import shutil
 import pickle
+import mmap
 import time
-import pandas as pd
 import mimetypes
 import json
 import os
 import base64
-import requests
-from get_access_token import get_access_token
+from google_api_client import google_request, get_backoff_delay, get_max_retries, RETRYABLE_STATUS_CODES, RETRYABLE_EXCEPTIONS
+from drive_mirror import MIRROR_FIELDS, get_mirror_path, is_mirror_current, record_mirrored_file
 from dotenv import load_dotenv
 
 # Load in directory-specific environem
@@ -16,120 +19,226 @@ load_dotenv()
 
 # Load in 
 downloads_dir = os.environ.get('DOWNLOAD_DIR', os.path.join(os.getcwd(), 'Downloads'))
-user_gmail = os.environ['EMAIL']
 
-access_token = get_access_token(user_gmail)
+# Memoised folder IDs shared by every Drive call in the process, keyed by (drivename, folder path)
+_folder_path_cache = {}
+_folder_path_lock = threading.Lock()
+
+# Resumable upload chunks must be multiples of 256 KiB
+UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+
+# Shared drive name to ID mapping, listed once per process
+_shared_drive_ids = None
+_shared_drive_lock = threading.Lock()
+
+def list_shared_drives(access_token=None, refresh=False):
+    """
+    Map the names of every shared drive the user can see to their IDs
+
+    The drive list is fetched once per process (following every page) and reused afterwards;
+    pass refresh=True to fetch it again.
+    """
+    global _shared_drive_ids
+
+    with _shared_drive_lock:
+        if _shared_drive_ids is not None and not refresh:
+            return dict(_shared_drive_ids)
+
+        # Retrieve drive IDs and names associated with a site
+        url = f'https://www.googleapis.com/drive/v3/drives'
+        params = {
+            'pageSize': 100,
+            'fields': 'nextPageToken, drives(id, name)'
+        }
+
+        drive_ids = {}
+        while True:
+            response = google_request('GET', url, access_token, params=params)
+            response.raise_for_status()
+            result = response.json()
+
+            for drive in result.get('drives', []):
+                drive_ids[drive['name']] = drive['id']
+
+            if 'nextPageToken' in result:
+                params['pageToken'] = result['nextPageToken']
+            else:
+                break
+
+        _shared_drive_ids = drive_ids
+        return dict(drive_ids)
+
+def get_drive_id(drivename, access_token=None):
+    drive_id = list_shared_drives(access_token).get(drivename)
+
+    # The drive may have been created or shared since the list was cached
+    if drive_id is None:
+        drive_id = list_shared_drives(access_token, refresh=True).get(drivename)
+
+    if drive_id is None:
+        print(f'No shared drive by the name "{drivename}" found')
+    return drive_id
+
+def _apply_drive_scope(params, drivename):
+    # Restrict a files.list query to one shared drive
+    if drivename:
+        drive_id = get_drive_id(drivename)
+        if drive_id is None:
+            raise ValueError(f'No shared drive by the name "{drivename}" found')
+        params['corpora'] = 'drive'
+        params['driveId'] = drive_id
+    return params
+
+def iter_drive_files(query, fields='id, name', drivename=None, page_size=1000, access_token=None, order_by=None):
+    """
+    Lazily yield the files matching a Drive search query, following nextPageToken
+
+    query: str
+        Drive search query e.g. "'<folder id>' in parents and trashed = false"
+
+    fields: str
+        File fields to return; keep this to what the caller reads
+
+    drivename: str
+        Only search this shared drive
+
+    page_size: int
+        Files per page (Drive allows up to 1000)
+
+    order_by: str
+        Sort order e.g. 'modifiedTime desc'
+
+    The next page is only requested once every file from the previous one has been consumed, so callers
+    that stop early never pay for the rest of the listing.
+    """
+    url = "https://www.googleapis.com/drive/v3/files"
 
-def get_drive_id(drivename, access_token):
-    # Retrieve drive IDs and names associated with a site
-    url = f'https://www.googleapis.com/drive/v3/drives'
-    headers = {'Authorization': f'Bearer {access_token}'}
     params = {
-        'pageSize': 100,
-        'supportsAllDrives': 'true',
-        'fields': 'nextPageToken, drives(id, name)'
+        'q': query,
+        'fields': f'nextPageToken, files({fields})',
+        'corpora': 'user',
+        'supportsAllDrives': True,
+        'includeItemsFromAllDrives': True,
+        'pageSize': page_size
     }
-    
+
+    if order_by:
+        params['orderBy'] = order_by
+
+    _apply_drive_scope(params, drivename)
+
     while True:
-        response = requests.get(url, headers)
+        response = google_request('GET', url, access_token, params=params)
+        response.raise_for_status()
         result = response.json()
 
-        for drive in result.get('drives', []):
-            if drive['name'] == drivename:
-                return drive['id']
+        yield from result.get('files', [])
 
         if 'nextPageToken' in result:
             params['pageToken'] = result['nextPageToken']
         else:
             break
 
-    print(f'No shared drive by the name "{drivename}" found')
-    return None
+def _escape_query_value(value):
+    return value.replace("\\", "\\\\").replace("'", "\\'")
 
-def get_folder_id(foldername, access_token, drivename=None):
-    url = "https://www.googleapis.com/drive/v3/files"
-
-    headers = {'Authorization': f'Bearer {access_token}'}
-    
+def get_folder_id(foldername, access_token=None, drivename=None):
     if foldername == '':
         return None
     else:
-        params = {
-            'q': f"mimeType = 'application/vnd.google-apps.folder' and name = '{foldername}' and trashed = false",
-            'fields': 'files(id, name)',
-            'corpora': 'user',
-            'supportsAllDrives': True,
-            'includeItemsFromAllDrives': True,
-            'pageSize': 100
-        }
-
-        if drivename:
-            drive_id = get_drive_id(drivename, access_token)
-            params['corpora'] = 'drive'
-            params['driveId'] = drive_id
+        query = f"mimeType = 'application/vnd.google-apps.folder' and name = '{_escape_query_value(foldername)}' and trashed = false"
 
-        response = requests.get(url, headers=headers, params=params)
-        files_result = response.json()['files']
-        if len(files_result) > 0:
-            return files_result[0]['id']
+        # Only the first match is used; Drive may still return an empty page before it, which the iterator follows
+        folder = next(iter_drive_files(query, 'id', drivename, page_size=1, access_token=access_token), None)
+        if folder:
+            return folder['id']
         else:
             print(f'No folders found under the name "{foldername}"')
             return None
     
-def get_item_id(folder_id, filename, access_token, drivename=None):
-    url = "https://www.googleapis.com/drive/v3/files"
-
-    headers = {'Authorization': f'Bearer {access_token}'}
-    
-    params = {
-        'fields': 'files(id, name)',
-        'corpora': 'user',
-        'supportsAllDrives': True,
-        'includeItemsFromAllDrives': True,
-        'pageSize': 100
-    }
-    
-    params['q'] = f"mimeType != 'application/vnd.google-apps.folder'and trashed = false and name = '{filename}'"
-    params['q'] += f" and '{folder_id}' in parents" if folder_id else ''
-
-    if drivename:
-        drive_id = get_drive_id(drivename, access_token)
-        params['corpora'] = 'drive'
-        params['driveId'] = drive_id
-
-    response = requests.get(url, headers=headers, params=params)
-    files_result = response.json()['files']
-    if len(files_result) > 0:
-        return files_result[0]['id']
+def _find_file_in_folder(folder_id, filename, fields='id', drivename=None, access_token=None):
+    # Without a folder, look in the root of My Drive, where files uploaded without a parent end up
+    query = f"mimeType != 'application/vnd.google-apps.folder' and trashed = false and name = '{_escape_query_value(filename)}'"
+    query += f" and '{folder_id or 'root'}' in parents"
+
+    # With duplicates from before files were updated in place, always pick the most recently modified one
+    return next(iter_drive_files(query, fields, drivename, page_size=1, access_token=access_token, order_by='modifiedTime desc'), None)
+
+def get_item_id(folder_id, filename, access_token=None, drivename=None):
+    item = _find_file_in_folder(folder_id, filename, 'id', drivename, access_token)
+    if item:
+        return item['id']
     else:
         print(f'No items found under the name "{filename}"')
         return None
     
-def google_drive_list_folders(foldername, drivename=None, return_ids=False):
-    folder_id = get_folder_id(foldername, access_token, drivename)
+def _get_child_folder_id(parent_folder_id, foldername, drivename=None):
+    query = f"mimeType = 'application/vnd.google-apps.folder' and trashed = false and name = '{_escape_query_value(foldername)}' and '{parent_folder_id}' in parents"
 
-    url = "https://www.googleapis.com/drive/v3/files"
+    folder = next(iter_drive_files(query, 'id', drivename, page_size=1), None)
+    return folder['id'] if folder else None
 
-    headers = {'Authorization': f'Bearer {access_token}'}
+def _split_folder_path(folder_path):
+    return [part for part in folder_path.strip('/').split('/') if part]
 
-    params = {
-        'fields': 'files(id, name)',
-        'corpora': 'user',
-        'supportsAllDrives': True,
-        'includeItemsFromAllDrives': True,
-        'pageSize': 100
-    }
+def resolve_folder_path(folder_path, drivename=None):
+    """
+    Resolve a folder path to the ID of its last folder e.g. 'JULIE FINANCING/2025 Debit Statements'
 
-    params['q'] = f"mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-    params['q'] += f" and '{folder_id}' in parents" if folder_id else ''
+    The first folder is found by name; every later one is looked up among the children of the folder
+    before it. Each resolved prefix is memoised for the process, so only path components never seen
+    before cost a Drive call.
 
-    if drivename:
-        drive_id = get_drive_id(drivename, access_token)
-        params['corpora'] = 'drive'
-        params['driveId'] = drive_id
+    Returns None if any folder along the path does not exist.
+    """
+    parts = _split_folder_path(folder_path)
+    if not parts:
+        return None
+
+    # Start from the deepest folder along the path that is already known
+    start, folder_id = 0, None
+    with _folder_path_lock:
+        for depth in range(len(parts), 0, -1):
+            cached_id = _folder_path_cache.get((drivename, '/'.join(parts[:depth])))
+            if cached_id:
+                start, folder_id = depth, cached_id
+                break
+
+    for depth in range(start, len(parts)):
+        if depth == 0:
+            folder_id = get_folder_id(parts[0], drivename=drivename)
+        else:
+            folder_id = _get_child_folder_id(folder_id, parts[depth], drivename)
+
+        if folder_id is None:
+            print(f'Folder "{parts[depth]}" not found within path.')
+            return None
+
+        with _folder_path_lock:
+            _folder_path_cache[(drivename, '/'.join(parts[:depth + 1]))] = folder_id
+
+    return folder_id
+
+def invalidate_folder_path(folder_path=None, drivename=None):
+    """
+    Forget the memoised ID of a folder path and of every path below it. With no folder_path, forget all paths
+    """
+    with _folder_path_lock:
+        if folder_path is None:
+            _folder_path_cache.clear()
+            return
+
+        path = '/'.join(_split_folder_path(folder_path))
+        for key in [key for key in _folder_path_cache if key[0] == drivename and (key[1] == path or key[1].startswith(path + '/'))]:
+            del _folder_path_cache[key]
 
-    response = requests.get(url, headers=headers, params=params)
-    files_result = response.json()['files']
+def google_drive_list_folders(foldername, drivename=None, return_ids=False):
+    folder_id = resolve_folder_path(foldername, drivename)
+
+    query = f"mimeType = 'application/vnd.google-apps.folder' and trashed = false"
+    query += f" and '{folder_id}' in parents" if folder_id else ''
+
+    files_result = list(iter_drive_files(query, 'id, name', drivename))
 
     if return_ids:
         return {item['name']:item['id'] for item in files_result}
@@ -142,38 +251,18 @@ def google_drive_list_folders(foldername, drivename=None, return_ids=False):
             return []
         
 def google_drive_list_files(foldername, drivename=None, search_string=None):
-    folder_id = get_folder_id(foldername, access_token, drivename)
-
-    url = "https://www.googleapis.com/drive/v3/files"
-
-    headers = {'Authorization': f'Bearer {access_token}'}
+    folder_id = resolve_folder_path(foldername, drivename)
 
     full_search_query = f"mimeType != 'application/vnd.google-apps.folder' and trashed = false"
     full_search_query += f" and '{folder_id}' in parents" if folder_id else ''
 
     if search_string:
-        full_search_query = full_search_query + f" and name contains '{search_string}'"
-        
-    params = {
-        'q': full_search_query,
-        'fields': 'files(id, name, mimeType)',
-        'corpora': 'user',
-        'supportsAllDrives': True,
-        'includeItemsFromAllDrives': True,
-        'pageSize': 100
-    }
-
-    if drivename:
-        drive_id = get_drive_id(drivename, access_token)
-        params['corpora'] = 'drive'
-        params['driveId'] = drive_id
+        full_search_query = full_search_query + f" and name contains '{_escape_query_value(search_string)}'"
 
-    response = requests.get(url, headers=headers, params=params)
-    files_result = response.json()['files']
+    available_files = [item['name'] for item in iter_drive_files(full_search_query, 'name', drivename)]
     
-    if len(files_result) > 0:
-        available_folders = [item['name'] for item in files_result]
-        return available_folders
+    if len(available_files) > 0:
+        return available_files
     else:
         print(f'No existing files found within "{foldername}" folder')
         return []
@@ -183,32 +272,27 @@ def google_drive_add_folder(foldername, drivename=None):
     foldername sample input: root_folder/sub_folder1/...sub_folderN/foldername
     """
     
-    parts = foldername.strip('/').split('/')
-    root_foldername, *intermediary_foldernames = parts
-
-    available_folders = google_drive_list_folders(root_foldername, drivename, return_ids=True)
-
-    if len(intermediary_foldernames) == 0:
-        new_foldername = root_foldername
-        parent_folder_id = get_folder_id(new_foldername, access_token)
+    parts = _split_folder_path(foldername)
+    *parent_foldernames, new_foldername = parts
 
+    # Look for the folder among its parent's children, resolving the parent through the path cache
+    if parent_foldernames:
+        parent_folder_id = resolve_folder_path('/'.join(parent_foldernames), drivename)
+        if parent_folder_id is None:
+            return
+        existing_folder_id = _get_child_folder_id(parent_folder_id, new_foldername, drivename)
     else:
-        root_foldername, *intermediary_foldernames, new_foldername = parts
-        for folder in intermediary_foldernames:
-            if folder in available_folders:
-                parent_folder_id = available_folders[folder]
-                available_folders = google_drive_list_folders(folder, None, return_ids=True)
-            else:
-                print(f'Folder "{folder}" not found within path.')
-                return
-    
-    if new_foldername in available_folders:
+        parent_folder_id = None
+        existing_folder_id = get_folder_id(new_foldername, drivename=drivename)
+
+    if existing_folder_id:
+        with _folder_path_lock:
+            _folder_path_cache[(drivename, '/'.join(parts))] = existing_folder_id
         print('Folder already exists')
         return
     
     else:
         url = "https://www.googleapis.com/drive/v3/files"
-        headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
         
         params = {"supportsAllDrives": True}
         body = {
@@ -216,17 +300,15 @@ def google_drive_add_folder(foldername, drivename=None):
             "mimeType": "application/vnd.google-apps.folder",
         }
 
-        if len(intermediary_foldernames) == 0:
-            parent_folder_id = get_folder_id(root_foldername, access_token)
-        else:
-            parent_folder_id = None
-
         if parent_folder_id:
             body["parents"] = [parent_folder_id]
 
-        response = requests.post(url, headers=headers, json=body, params=params)
+        response = google_request('POST', url, json=body, params=params)
 
         if response.status_code == 200:
+            # The new folder can be used straight away without looking it up again
+            with _folder_path_lock:
+                _folder_path_cache[(drivename, '/'.join(parts))] = response.json()['id']
             print('Folder successfully created.')
             return
 
@@ -236,28 +318,15 @@ def google_drive_delete_item(foldername, filename=None, drivename=None):
     foldername sample input: root_folder/sub_folder1/...sub_folderN/foldername
     """
     
-    parts = foldername.strip('/').split('/')
-    root_foldername, *intermediary_foldernames = parts
-
-    available_folders = google_drive_list_folders(root_foldername, drivename, return_ids=True)
-
-    if len(intermediary_foldernames) == 0:
-        parent_folder_id = get_folder_id(root_foldername)
-    else:
-        for folder in intermediary_foldernames:
-            if folder in available_folders:
-                parent_folder_id = available_folders[folder]
-                available_folders = google_drive_list_folders(folder, drivename, return_ids=True)
-            else:
-                print(f'Folder "{folder}" not found within path.')
-                return
+    parent_folder_id = resolve_folder_path(foldername, drivename)
+    if parent_folder_id is None:
+        return
     
-    headers = {'Authorization': f'Bearer {access_token}'}
     params = {"supportsAllDrives": True}
 
     # Option to delete a file item
     if filename:
-        item_id = get_item_id(parent_folder_id, filename, access_token, drivename)
+        item_id = get_item_id(parent_folder_id, filename, drivename=drivename)
     
     # Option to delete a full folder
     else:
@@ -265,157 +334,310 @@ def google_drive_delete_item(foldername, filename=None, drivename=None):
 
     url = f"https://www.googleapis.com/drive/v3/files/{item_id}"
 
-    response = requests.delete(url, headers=headers, params=params)
+    response = google_request('DELETE', url, params=params)
     
     if response.status_code == 204:
+        # A deleted folder takes its whole subtree with it
+        if not filename:
+            invalidate_folder_path(foldername, drivename)
         print('Item successfully deleted')
     else:
         raise
 
 def google_drive_get_link(foldername, filename=None, drivename=None):
-    parts = foldername.strip('/').split('/')
-    root_foldername, *intermediary_foldernames = parts
-
-    available_folders = google_drive_list_folders(root_foldername, drivename, return_ids=True)
-    
-    if len(intermediary_foldernames) == 0:
-        parent_folder_id = get_folder_id(root_foldername, access_token, drivename)
-    else:
-        for folder in intermediary_foldernames:
-            if folder in available_folders:
-                parent_folder_id = available_folders[folder]
-                available_folders = google_drive_list_folders(folder, drivename, return_ids=True)
-            else:
-                print(f'Folder "{folder}" not found within path.')
-                return
-    
-    headers = {'Authorization': f'Bearer {access_token}'}
-    params = {"supportsAllDrives": True}
+    parent_folder_id = resolve_folder_path(foldername, drivename)
+    if parent_folder_id is None:
+        return
     
     if filename:
-        item_id = get_item_id(parent_folder_id, filename, access_token, drivename)
+        item_id = get_item_id(parent_folder_id, filename, drivename=drivename)
     else:
         item_id = parent_folder_id
 
 
     url = f"https://www.googleapis.com/drive/v3/files/{item_id}"
-    headers = {'Authorization': f'Bearer {access_token}'}
     params = {
         "fields": "webViewLink",
         "supportsAllDrives": True
     }
 
-    response = requests.get(url, headers=headers, params=params)
+    response = google_request('GET', url, params=params)
     if response.status_code == 200:
         return response.json().get("webViewLink")
     else:
         print(f"Error fetching link: {response.text}")
         return None
     
-def google_drive_download_file(foldername, filename, drivename=None):
+def google_drive_download_file(foldername, filename, drivename=None, use_mirror=True):
+    """
+    Download a file from a Drive folder into DOWNLOAD_DIR
+
+    use_mirror: bool
+        Keep a copy in the local Drive mirror (DRIVE_MIRROR_DIR), keyed by file ID, and skip the download
+        when that copy's md5Checksum, modifiedTime and headRevisionId still match Drive's
+    """
     export_mapping = {
         'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',  # .pptx
         'application/vnd.google-apps.document': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',       # .docx
         'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'            # .xlsx
     }
     
-    parts = foldername.strip('/').split('/')
-    root_foldername, *intermediary_foldernames = parts
-
-    available_folders = google_drive_list_folders(root_foldername, drivename, return_ids=True)
-    
-    if len(intermediary_foldernames) == 0:
-        parent_folder_id = get_folder_id(root_foldername, access_token, drivename)
-    else:
-        for folder in intermediary_foldernames:
-            if folder in available_folders:
-                parent_folder_id = available_folders[folder]
-                available_folders = google_drive_list_folders(folder, drivename, return_ids=True)
-            else:
-                print(f'Folder "{folder}" not found within path.')
-                return
+    parent_folder_id = resolve_folder_path(foldername, drivename)
+    if parent_folder_id is None:
+        return
             
-    item_id = get_item_id(parent_folder_id, filename, access_token, drivename)
+    item_id = get_item_id(parent_folder_id, filename, drivename=drivename)
+    if item_id is None:
+        print(f'Nothing to download: "{filename}" not found in {foldername}')
+        return
     
-    headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
     url = f"https://www.googleapis.com/drive/v3/files/{item_id}"
     params = {
+        'fields': MIRROR_FIELDS,
         'supportsAllDrives': True,
     }
 
-    item_response = requests.get(url, headers=headers, params=params)    # , stream=True
-    item_format = item_response.json().get('mimeType', None)
+    item_response = google_request('GET', url, params=params)    # , stream=True
+    item_response.raise_for_status()
+    item_metadata = item_response.json()
+    download_path = os.path.join(downloads_dir, filename)
+    mirror_path = get_mirror_path(item_id)
+
+    # The metadata call alone tells whether the mirrored copy from an earlier run is still current
+    if use_mirror and is_mirror_current(item_id, item_metadata):
+        shutil.copyfile(mirror_path, download_path)
+        print("File unchanged since last download; copied from local mirror.")
+        return
+
+    item_format = item_metadata.get('mimeType', None)
     if item_format in export_mapping:
         url = f"https://www.googleapis.com/drive/v3/files/{item_id}/export"
         params = {'mimeType': export_mapping[item_format]}
     else:
         # Other formats → use regular download
-        params = {'alt': 'media'}
+        params = {'alt': 'media', 'supportsAllDrives': True}
 
-    response = requests.get(url, headers=headers, params=params, stream=True)
+    response = google_request('GET', url, params=params, stream=True)
     if response.status_code == 200:
-        download_path = os.path.join(downloads_dir, filename)
-        with open(download_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        # Write into the mirror first so the next run can skip the download
+        target_path = mirror_path if use_mirror else download_path
+        temp_path = f'{target_path}.part'
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if chunk:
+                        f.write(chunk)
+            os.replace(temp_path, target_path)
+        finally:
+            response.close()
+
+            # A download cut short by an error leaves its partial file behind; never let it linger
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        if use_mirror:
+            record_mirrored_file(item_id, item_metadata)
+            shutil.copyfile(mirror_path, download_path)
+
         print(f"Successfully downloaded file.")
         return
     else:
         print(f"Failed to download file: {response.text}")
         return
     
-def google_drive_upload_file(local_filepath, dest_foldername, drivename=None, delete_sourcefile=False):
+def _get_upload_chunk_size():
+    # Drive requires every chunk but the last to be a multiple of 256 KiB
+    chunk_size = int(os.environ.get('DRIVE_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    return max(UPLOAD_CHUNK_ALIGNMENT, chunk_size - chunk_size % UPLOAD_CHUNK_ALIGNMENT)
+
+def _get_resumable_threshold():
+    return int(os.environ.get('DRIVE_RESUMABLE_THRESHOLD', 5 * 1024 * 1024))
+
+def _get_committed_offset(response):
+    # A 308 reports what Drive has stored as e.g. 'Range: bytes=0-524287'; no Range header means nothing yet
+    byte_range = response.headers.get('Range')
+    return int(byte_range.split('-')[-1]) + 1 if byte_range else 0
+
+def _read_chunk(source, offset, size):
+    if hasattr(source, 'seek'):
+        source.seek(offset)
+        return source.read(size)
+    return source[offset:offset + size]
+
+def upload_resumable(source, total_size, metadata, mime_type, chunk_size=None, file_id=None):
+    """
+    Upload content to Drive through a resumable session, sending it in chunks
+
+    source: file | mmap | bytes
+        Open binary file or buffer holding the content; only one chunk is read into memory at a time
+
+    total_size: int
+        Size of the content in bytes
+
+    metadata: dict
+        File metadata e.g. {'name': ..., 'mimeType': ..., 'parents': [...]}
+
+    mime_type: str
+        MIME type of the content
+
+    chunk_size: int
+        Bytes per chunk, rounded down to a multiple of 256 KiB. Defaults to DRIVE_UPLOAD_CHUNK_SIZE (8 MiB)
+
+    file_id: str
+        Upload the content as a new revision of this existing file instead of creating a new one
+
+    When a chunk fails, Drive is asked how many bytes it has committed and the upload carries on from
+    that offset instead of starting over. Returns the final response.
+    """
+    chunk_size = chunk_size or _get_upload_chunk_size()
+    chunk_size = max(UPLOAD_CHUNK_ALIGNMENT, chunk_size - chunk_size % UPLOAD_CHUNK_ALIGNMENT)
+
+    url = 'https://www.googleapis.com/upload/drive/v3/files'
+    params = {'uploadType': 'resumable', 'supportsAllDrives': True}
+    headers = {'X-Upload-Content-Type': mime_type, 'X-Upload-Content-Length': str(total_size)}
+
+    # files.update takes the same session setup on the file's own URL
+    method = 'PATCH' if file_id else 'POST'
+    if file_id:
+        url += f'/{file_id}'
+
+    # Starting a session uploads nothing; an unused extra session simply expires
+    response = google_request(method, url, headers=headers, params=params, json=metadata, idempotent=True)
+    response.raise_for_status()
+    session_uri = response.headers['Location']
+
+    offset = 0
+    attempt = 0
+    while True:
+        chunk = _read_chunk(source, offset, chunk_size)
+        content_range = f'bytes {offset}-{offset + len(chunk) - 1}/{total_size}'
+
+        # Failed chunks are not blindly re-sent; the resume below works out what still needs sending
+        try:
+            response = google_request('PUT', session_uri, headers={'Content-Range': content_range}, data=chunk, max_retries=0)
+        except RETRYABLE_EXCEPTIONS as e:
+            print(f'Upload interrupted at byte {offset} ({type(e).__name__})')
+            response = None
+
+        if response is not None:
+            if response.status_code in (200, 201):
+                return response
+            if response.status_code == 308:
+                offset = _get_committed_offset(response)
+                attempt = 0
+                continue
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+
+        if attempt >= get_max_retries():
+            raise RuntimeError(f'Resumable upload of {metadata.get("name")} failed at byte {offset} after {attempt} retries')
+
+        delay = get_backoff_delay(attempt, response)
+        print(f'Resuming upload in {delay:.1f}s...')
+        time.sleep(delay)
+        attempt += 1
+
+        # Ask Drive which bytes it actually stored before sending anything again
+        status = google_request('PUT', session_uri, headers={'Content-Range': f'bytes */{total_size}'})
+        if status.status_code in (200, 201):
+            return status
+        if status.status_code != 308:
+            return status
+        offset = _get_committed_offset(status)
+
+def _get_file_md5(local_filepath):
+    hasher = hashlib.md5()
+    with open(local_filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _delete_local_file(local_filepath):
+    try:
+        os.remove(local_filepath)
+        print(f"Deleted local file: {local_filepath}")
+    except OSError as e:
+        print(f"Error deleting file: {e}")
+
+def google_drive_upload_file(local_filepath, dest_foldername, drivename=None, delete_sourcefile=False, resumable=None, chunk_size=None, overwrite=False):
+    """
+    Upload a local file into a Drive folder
+
+    resumable: bool
+        Whether to use a chunked, resumable upload. Defaults to doing so for files of at least
+        DRIVE_RESUMABLE_THRESHOLD bytes (5 MiB)
+
+    chunk_size: int
+        Bytes per chunk for resumable uploads. Defaults to DRIVE_UPLOAD_CHUNK_SIZE
+
+    overwrite: bool
+        If a file with the same name is already in the folder, upload a new revision of it rather than a
+        second copy. The upload is skipped altogether when its MD5 matches Drive's md5Checksum
+
+    Returns True once Drive holds the file's contents (uploaded, or unchanged and skipped), False if the
+    destination folder does not exist or the upload failed.
+    """
     file_name = os.path.basename(local_filepath)
     mime_type = mimetypes.guess_type(local_filepath)[0] or 'application/octet-stream'
+    file_size = os.path.getsize(local_filepath)
 
-    headers = {'Authorization': f'Bearer {access_token}'}
-
-    # Add file metadata to params dictionary
-    params = {
+    # File metadata only; upload options go in the query string
+    metadata = {
         'name': file_name,
         'mimeType': mime_type,
-        'supportAllDrives': True,
-        'uploadType': 'multipart'
     }
 
     if dest_foldername != '':
         # Find the parent folder
-        parts = dest_foldername.strip('/').split('/')
-        root_foldername, *intermediary_foldernames = parts
-        available_folders = google_drive_list_folders(root_foldername, drivename, return_ids=True)
-        
-        if not intermediary_foldernames:
-            parent_folder_id = get_folder_id(root_foldername, access_token, drivename)
-        else:
-            for folder in intermediary_foldernames:
-                if folder in available_folders:
-                    parent_folder_id = available_folders[folder]
-                    available_folders = google_drive_list_folders(folder, drivename, return_ids=True)
-                else:
-                    print(f'Folder "{folder}" not found within path.')
-                    return
+        parent_folder_id = resolve_folder_path(dest_foldername, drivename)
+        if parent_folder_id is None:
+            return False
         
-        params['parents'] = [parent_folder_id]
+        metadata['parents'] = [parent_folder_id]
+
+    existing_file = None
+    if overwrite:
+        existing_file = _find_file_in_folder(metadata.get('parents', [None])[0], file_name, 'id, md5Checksum', drivename)
+
+    if existing_file and existing_file.get('md5Checksum') == _get_file_md5(local_filepath):
+        print(f"Unchanged, skipped upload: {file_name}")
+        if delete_sourcefile:
+            _delete_local_file(local_filepath)
+        return True
+
+    if existing_file:
+        # A file's parents cannot be set through files.update; it stays where it is
+        metadata.pop('parents', None)
+        print(f"Updating existing file: {file_name}")
+
+    file_id = existing_file['id'] if existing_file else None
+    url = 'https://www.googleapis.com/upload/drive/v3/files'
+    if file_id:
+        url += f'/{file_id}'
+
+    if resumable is None:
+        resumable = file_size >= _get_resumable_threshold()
 
     with open(local_filepath, 'rb') as f:
-        files = {
-            'metadata': ('metadata', json.dumps(params), 'application/json'),
-            'file': (file_name, f, mime_type)
-        }
+        # Empty files cannot be memory-mapped and gain nothing from chunking
+        if resumable and file_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                response = upload_resumable(buffer, file_size, metadata, mime_type, chunk_size, file_id)
 
-        url = 'https://www.googleapis.com/upload/drive/v3/files'
-        response = requests.post(url, headers=headers, files=files)
+        else:
+            files = {
+                'metadata': ('metadata', json.dumps(metadata), 'application/json'),
+                'file': (file_name, f, mime_type)
+            }
+
+            params = {'uploadType': 'multipart', 'supportsAllDrives': True}
+            response = google_request('PATCH' if file_id else 'POST', url, params=params, files=files)
 
     if response.status_code in (200, 201):
         print(f"Uploaded successfully: {file_name}")
         if delete_sourcefile:
-            try:
-                os.remove(local_filepath)
-                print(f"Deleted local file: {local_filepath}")
-            except OSError as e:
-                print(f"Error deleting file: {e}")
-            return None
+            _delete_local_file(local_filepath)
+        return True
     else:
         print(f"Failed to upload: {response.status_code} - {response.text}")
-        return None
\ No newline at end of file
+        return False
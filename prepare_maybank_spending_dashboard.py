@@ -1,14 +1,13 @@
 import pandas as pd
 from datetime import datetime
-from relocate_emails_to_folders import move_emails, list_all_folders
-from retrieve_gmail_attachments import retrieve_gmail_attachments
-from retrieve_gmail_body import retrieve_gmail_body
+from relocate_emails_to_folders import move_emails, list_all_folders, mark_emails_processed, get_processed_label
+from retrieve_gmail_attachments import download_message_attachments
+from gmail_planner import mailbox_consumer, scan_mailbox
 from google_drive_file_mgmt import google_drive_add_folder, google_drive_upload_file, google_drive_get_link
 from send_gmail_message import send_email_gmail
 from pypdf import PdfReader
 import os
 import re
-import time
 import calendar
 import shutil
 from dotenv import load_dotenv
@@ -17,7 +16,6 @@ load_dotenv('.env')
 # Define timing parameters
 today = datetime.today()
 current_year = today.year
-max_retries = 5
 
 # Create Downloads local directory
 download_dir = os.path.join(os.getcwd(), 'Downloads')
@@ -32,15 +30,24 @@ root_folder = 'JULIE FINANCING'
 # List of relevant email addresses from Maybank
 relevant_maybank_emails = ['m2u@maybank.com.my', "m2u@bills.maybank2u.com.my", "m2u@stmts.maybank2u.com.my", 'maybankard@edm.maybank2u.com.my']
 
+# Statements this pipeline has already ingested carry its own processed label
+processed_label = get_processed_label('Dashboard')
+
+# Sweep outstanding Maybank emails into their folder and find monthly statements in a single mailbox scan
+inbox_sweep = mailbox_consumer('inbox_sweep', ['INBOX'], email_filter=relevant_maybank_emails, profile='ids', add_labels=['MayBank'], remove_labels=['INBOX'])
+statements = mailbox_consumer('statements', ['MayBank'], subject_filter=["Savings Account Statement "], profile='attachments', exclude_labels=[processed_label])
+mailbox_shares, _ = scan_mailbox(sender_email, today, 32, [inbox_sweep, statements])
+
 # Move outstanding Maybank emails into designated folder
-maybank_df = retrieve_gmail_body(sender_email, today, 32, ['INBOX'], True, email_filter=relevant_maybank_emails)
-if maybank_df.empty:
+if len(mailbox_shares['inbox_sweep']) == 0:
     print('No new emails found to move.')
 else:
-    move_emails(sender_email, maybank_df['Id'].to_list(), ['MayBank'], ['INBOX'])
+    move_emails(sender_email, [message['id'] for message in mailbox_shares['inbox_sweep']], inbox_sweep['add_labels'], inbox_sweep['remove_labels'])
 
 # Download monthly statement
-statement_files = retrieve_gmail_attachments(sender_email, today, 32, 'MayBank', subject_filter=["Savings Account Statement "])
+# Statements already ingested on earlier runs carry the processed label and are excluded from the scan
+statement_message_ids = {filename: message_id for message_id, filename in download_message_attachments(sender_email, mailbox_shares['statements'], filename_pattern='*.pdf', return_message_id=True)}
+statement_files = list(statement_message_ids)
 
 if len(statement_files) == 0:
     print('No MayBank statements found this month.')
@@ -59,16 +66,7 @@ else:
         statements_gdrive_folderpath = f'{root_folder}/{statements_foldername}'
 
         # Add new folder for the year if does not exist
-        for i in range(max_retries):
-            try:
-                google_drive_add_folder(statements_gdrive_folderpath)
-                break
-            except Exception as e:
-                if i < max_retries - 1:
-                    print('Retrying file upload to Google Drive...')
-                    time.sleep(2)
-                else:
-                    raise
+        google_drive_add_folder(statements_gdrive_folderpath)
 
         # Decrypt document password
         if reader.is_encrypted:
@@ -148,20 +146,12 @@ else:
             output_fn = f'{statement_month}{statement_year}_Maybank_transactions.xlsx'
             spending_records_df.to_excel(os.path.join(download_dir, output_fn), index=False)
 
-            for i in range(max_retries):
-                try:
-                    # Upload Excel to Google drive
-                    google_drive_upload_file(os.path.join(download_dir, output_fn), statements_gdrive_folderpath, delete_sourcefile=True)
-
-                    # Get direct link to Google sheet 
-                    document_link = google_drive_get_link(statements_gdrive_folderpath, output_fn)
-                    break
-                except Exception as e:
-                    if i < max_retries - 1:
-                        print('Retrying file upload to Google Drive...')
-                        time.sleep(2)
-                    else:
-                        raise
+            # Upload Excel to Google drive, recording the statement email as ingested only once Drive has it
+            if google_drive_upload_file(os.path.join(download_dir, output_fn), statements_gdrive_folderpath, delete_sourcefile=True):
+                mark_emails_processed(sender_email, [statement_message_ids[file]], processed_label)
+
+            # Get direct link to Google sheet 
+            document_link = google_drive_get_link(statements_gdrive_folderpath, output_fn)
 
             # Define email subject and body
             email_subject = f'{month_name}{statement_year} Bank Statement Transaction Compilation'
@@ -189,17 +179,7 @@ else:
             """
 
             # Send email
-            for i in range(max_retries):
-                try:
-                    send_email_gmail(sender_email, [sender_email], [], [], email_subject, email_body, '', [])
-                    break
-                except Exception as e:
-                    if i < max_retries - 1:
-                        print(f'Attempt {i+1} failed. Resending email...')
-                        time.sleep(2)
-                    else:
-                        print('All attempts failed.')
-                        raise e
+            send_email_gmail(sender_email, [sender_email], [], [], email_subject, email_body, '', [])
 
         else:
             email_subject = f'[ERROR] {month_name}{statement_year} Bank Statement Transaction Compilation'
@@ -221,17 +201,7 @@ else:
             </html>
             """
 
-            for i in range(max_retries):
-                try:
-                    send_email_gmail(sender_email, [sender_email], [], [], email_subject, email_body, '', [])
-                    break
-                except Exception as e:
-                    if i < max_retries - 1:
-                        print(f'Attempt {i+1} failed. Resending email...')
-                        time.sleep(2)
-                    else:
-                        print('All attempts failed.')
-                        raise e
+            send_email_gmail(sender_email, [sender_email], [], [], email_subject, email_body, '', [])
         
 # Remove already-processed files
 for file in statement_files:
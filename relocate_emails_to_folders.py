@@ -3,53 +3,95 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 import mimetypes
-import pandas as pd
 # from google_auth_oauthlib.flow import Flow, InstalledAppFlow
 # from googleapiclient.discovery import build
 # from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 # from google.auth.transport.requests import Request
 from datetime import datetime, timedelta
+import threading
 import pickle
 import time
 import os
 import base64
-import requests
-from get_access_token import get_access_token
+from google_api_client import google_request
+from gmail_fetch import map_bounded
 from dotenv import load_dotenv
 
 # Load in directory-specific environem
 load_dotenv()
 
-user_gmail = os.environ['EMAIL']
-
 base_url = 'https://gmail.googleapis.com/gmail/v1/users/'
 
+def get_processed_label(pipeline):
+    """
+    Name of the label marking emails whose contents a pipeline has already ingested. Each pipeline has its
+    own label, so one pipeline ingesting a statement never hides it from another
+
+    pipeline: str
+        Pipeline name e.g. 'Consolidated'. The label is GMAIL_PROCESSED_LABEL_<PIPELINE> if set, otherwise
+        'MayBank/Processed/<pipeline>'
+    """
+    return os.environ.get(f'GMAIL_PROCESSED_LABEL_{pipeline.upper()}', f'MayBank/Processed/{pipeline}')
+
+# Gmail accepts at most 1000 message IDs in a single batchModify call
+MAX_BATCH_MODIFY_IDS = 1000
+
+# Gmail's built-in labels are addressed by name and cannot be created or deleted
+SYSTEM_LABELS = {'INBOX', 'SPAM', 'TRASH', 'UNREAD', 'STARRED', 'IMPORTANT', 'SENT', 'DRAFT', 'CHAT',
+                 'CATEGORY_PERSONAL', 'CATEGORY_SOCIAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_UPDATES', 'CATEGORY_FORUMS'}
+
+# In-memory label registry shared by every module in the process, keyed by user: (fetched at, {name: id})
+_label_cache = {}
+_label_cache_lock = threading.Lock()
+
+def _get_label_cache_ttl():
+    return float(os.environ.get('GMAIL_LABEL_CACHE_TTL', 300))
+
+def invalidate_label_cache(user_id=None):
+    """
+    Drop cached label IDs for one user, or for every user when user_id is None
+    """
+    with _label_cache_lock:
+        if user_id is None:
+            _label_cache.clear()
+        else:
+            _label_cache.pop(user_id, None)
+
 # Function to list all available folders
-def list_all_folders(user_id):
+def list_all_folders(user_id, use_cache=True):
     """
     List all folders/labels within user's Gmail
 
     user_id: str
         User's email address
+
+    use_cache: bool
+        Whether to serve the mapping from the label registry if it was fetched within GMAIL_LABEL_CACHE_TTL seconds
+
+    Returns {label name: label ID}.
     """
-    access_token = get_access_token(user_gmail)
+    if use_cache:
+        with _label_cache_lock:
+            cached = _label_cache.get(user_id)
+        if cached and time.time() - cached[0] < _get_label_cache_ttl():
+            return dict(cached[1])
 
     url = f'{base_url}{user_id}/labels'
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
 
     try:
-        response = requests.get(url=url, headers=headers)
+        response = google_request('GET', url)
+        response.raise_for_status()
         response_data = response.json()
 
         labels_list = response_data['labels']
         label_id_dict = {label['name']: label['id'] for label in labels_list}
 
+        with _label_cache_lock:
+            _label_cache[user_id] = (time.time(), label_id_dict)
+
         # print(f"No. available folders: {len(labels_list)}")
         # print([label['name'] for label in labels_list])
-        return label_id_dict
+        return dict(label_id_dict)
 
     except Exception as e:
         print(f'Unexpected error occurred while attempting to list labels')
@@ -63,45 +105,178 @@ def create_new_label(user_id, folder_name):
     
     user_id: str
         User's email address
+
+    Returns the new label's ID, or None if it could not be created.
     """
     # creds = get_credentials()
     # client_id, client_secret, refresh_token = creds.client_id, creds.client_secret, creds.refresh_token
-    access_token = get_access_token(user_gmail)
 
     url = f'{base_url}{user_id}/labels'
 
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
-
     payload = {
         'name': folder_name,
         'type': 'user'
     }
 
     try:
-        response = requests.post(url=url, headers=headers, json=payload)
+        # A repeated create only returns 409, which is handled below
+        response = google_request('POST', url, json=payload, idempotent=True)
         response_data = response.json()
 
+        # The label list has changed either way
+        invalidate_label_cache(user_id)
+
         if response.status_code == 200 and 'id' in response_data:
             print(f"Successfully created new folder")
+            return response_data['id']
             
         elif response.status_code == 409:  # Conflict error (e.g., label already exists)
-            # label_id_dict = list_all_folders(access_token, user_id)
             print(f"Label already exists")
+            return list_all_folders(user_id).get(folder_name)
             
         else:
             print(f"Unexpected error: {response_data}")
-            
+            return None
 
     except Exception as e:
         print('Folder creation failed due to an exception')
         raise e
 
 
+def resolve_label_ids(user_id, label_names: list, create_missing=True):
+    """
+    Map label names to label IDs through the label registry
+
+    user_id: str
+        User's email address
+
+    label_names: list
+        Label names e.g. ['MayBank', 'INBOX']
+
+    create_missing: bool
+        Whether to create user labels that do not exist yet. Otherwise missing labels are left out
+    """
+    label_id_dict = list_all_folders(user_id)
+
+    # A label created elsewhere since the registry was filled only costs one refresh
+    if any(name not in label_id_dict and name not in SYSTEM_LABELS for name in label_names):
+        label_id_dict = list_all_folders(user_id, use_cache=False)
+
+    label_ids = []
+    for name in label_names:
+        if name in label_id_dict:
+            label_ids.append(label_id_dict[name])
+        elif name in SYSTEM_LABELS:
+            label_ids.append(name)
+        elif create_missing:
+            label_id = create_new_label(user_id, name)
+            if label_id is None:
+                raise ValueError(f'Label "{name}" does not exist and could not be created')
+            label_ids.append(label_id)
+
+    return label_ids
+
+def resolve_label_id(user_id, label_name):
+    """
+    Map a single label name to its ID through the label registry, without creating it. Built-in labels and
+    values that are already a label ID (e.g. a retrieve_* label_ids argument) are returned unchanged
+
+    Returns None if label_name is None or no such label exists.
+    """
+    if label_name is None or label_name in SYSTEM_LABELS:
+        return label_name
+
+    label_id_dict = list_all_folders(user_id)
+
+    # A label created elsewhere since the registry was filled only costs one refresh
+    if label_name not in label_id_dict and label_name not in label_id_dict.values():
+        label_id_dict = list_all_folders(user_id, use_cache=False)
+
+    if label_name in label_id_dict:
+        return label_id_dict[label_name]
+    if label_name in label_id_dict.values():
+        return label_name
+    return None
+
+
+def _get_modify_chunk_size():
+    return min(int(os.environ.get('GMAIL_MODIFY_CHUNK_SIZE', MAX_BATCH_MODIFY_IDS)), MAX_BATCH_MODIFY_IDS)
+
+def _get_modify_rate():
+    # batchModify costs 50 quota units and users get 250 per second, so 5 calls per second stays inside it
+    return float(os.environ.get('GMAIL_MODIFY_RATE_PER_SEC', 5))
+
+# Earliest time the next batchModify call may start, shared by every thread in the process
+_next_modify_at = 0.0
+_modify_rate_lock = threading.Lock()
+
+def _wait_for_modify_slot():
+    """
+    Space batchModify calls at least 1 / GMAIL_MODIFY_RATE_PER_SEC seconds apart (0 disables the limit)
+    """
+    global _next_modify_at
+
+    rate = _get_modify_rate()
+    if rate <= 0:
+        return
+
+    with _modify_rate_lock:
+        now = time.monotonic()
+        start_at = max(now, _next_modify_at)
+        _next_modify_at = start_at + 1 / rate
+
+    if start_at > now:
+        time.sleep(start_at - now)
+
+def batch_modify_labels(user_id, message_ids: list, add_label_ids: list = [], remove_label_ids: list = [], max_workers=None):
+    """
+    Add and/or remove labels on any number of emails, splitting the IDs into batchModify calls of at most
+    GMAIL_MODIFY_CHUNK_SIZE (max 1000) and sending them concurrently, no faster than GMAIL_MODIFY_RATE_PER_SEC
+    calls per second
+
+    user_id: str
+        User's email address
+
+    message_ids: list
+        List of unique email identifiers
+
+    add_label_ids / remove_label_ids: list
+        Label IDs (not names) to add or remove
+
+    max_workers: int
+        Maximum number of chunks in flight. Defaults to GMAIL_FETCH_CONCURRENCY
+
+    Each chunk is its own request, so a rate-limited or failed chunk is retried on its own without
+    resending the others. Returns one result per chunk, in order:
+    {'message_ids': [...], 'status_code': int or None, 'error': str or None}
+    """
+    url = f"{base_url}{user_id}/messages/batchModify"
+    chunk_size = _get_modify_chunk_size()
+    chunks = [message_ids[start:start + chunk_size] for start in range(0, len(message_ids), chunk_size)]
+
+    def modify_chunk(chunk):
+        body = {'ids': chunk}
+        if add_label_ids:
+            body['addLabelIds'] = add_label_ids
+        if remove_label_ids:
+            body['removeLabelIds'] = remove_label_ids
+
+        _wait_for_modify_slot()
+
+        # One chunk failing must not stop the others from being applied
+        try:
+            # Adding or removing the same labels twice leaves the emails as they were
+            response = google_request('POST', url, json=body, idempotent=True)
+        except Exception as e:
+            return {'message_ids': chunk, 'status_code': None, 'error': str(e)}
+
+        error = None if response.status_code == 204 else response.text
+        return {'message_ids': chunk, 'status_code': response.status_code, 'error': error}
+
+    return map_bounded(modify_chunk, chunks, max_workers)
+
 # Function to move email(s) between folders
-def move_emails(user_id, message_ids: list, dest_folder_locs: list, remove_curr_locs=[]):
+def move_emails(user_id, message_ids: list, dest_folder_locs: list, remove_curr_locs=[], max_workers=None):
     """
     Move email between labels
 
@@ -116,54 +291,51 @@ def move_emails(user_id, message_ids: list, dest_folder_locs: list, remove_curr_
     
     remove_curr_locs: list
         Whether to remove email from other locations it may be in upon moving
+
+    max_workers: int
+        Maximum number of batchModify calls in flight. Defaults to GMAIL_FETCH_CONCURRENCY
+
+    Returns the per-chunk results from batch_modify_labels. Raises RuntimeError once every chunk has been
+    tried if any of them failed, so callers do not carry on as if the emails had moved.
     """
     # creds = get_credentials()
     # client_id, client_secret, refresh_token = creds.client_id, creds.client_secret, creds.refresh_token
-    access_token = get_access_token(user_gmail)
 
-    # url = f"{base_url}{user_id}/messages/{message_id}/modify"
-    url = f"{base_url}{user_id}/messages/batchModify"
-
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
-
-    # Get corresponding label ID based on folder name input
-    label_id_dict = list_all_folders(user_id)
-    dest_label_id_list = [label_id_dict[labelname] for labelname in dest_folder_locs]     # Cannot have any core locations in this list (i.e. SPAM, INBOX, SENT, etc.)
-    
-    body = {
-        'ids': message_ids,
-        'addLabelIds': dest_label_id_list
-    }
+    # Get corresponding label ID based on folder name input, creating destination labels that do not exist yet
+    dest_label_id_list = resolve_label_ids(user_id, dest_folder_locs)
 
     # Attempt to move folder from current location to destination while remove current locations
+    curr_label_id_list = []
     if len(remove_curr_locs) > 0:
-        curr_label_id_list = [label_id_dict[labelname] for labelname in remove_curr_locs]
-        body['removeLabelIds'] = curr_label_id_list
+        curr_label_id_list = resolve_label_ids(user_id, remove_curr_locs, create_missing=False)
         remove_msg = f' and removed from the following folders: {remove_curr_locs}'
 
     try:
-        response = requests.post(url=url, headers=headers, json=body)
-        # response_data = response.json()
+        results = batch_modify_labels(user_id, message_ids, dest_label_id_list, curr_label_id_list, max_workers)
 
-        if response.status_code == 204:
-            response_msg = f"Successfully copied provided email IDs to {dest_folder_locs}"
+        failed = [result for result in results if result['error']]
+        moved_count = len(message_ids) - sum(len(result['message_ids']) for result in failed)
+
+        if moved_count:
+            response_msg = f"Successfully copied {moved_count} email ID(s) to {dest_folder_locs}"
 
             if remove_curr_locs:
                 response_msg += remove_msg
             
             print(response_msg)
-        
 
-        else:
-            print(response)
+        for result in failed:
+            print(f"Failed to move {len(result['message_ids'])} email ID(s) ({result['status_code']}): {result['error']}")
 
     except Exception as e:
         print('An unexpected error occured when moving email to another folder.')
         raise e
 
+    if failed:
+        raise RuntimeError(f"{len(message_ids) - moved_count} of {len(message_ids)} email ID(s) could not be moved to {dest_folder_locs}")
+
+    return results
+
 # Function to delete email from a folder
 def remove_label(user_id, label_name):
     """
@@ -176,26 +348,21 @@ def remove_label(user_id, label_name):
     """
     # creds = get_credentials()
     # client_id, client_secret, refresh_token = creds.client_id, creds.client_secret, creds.refresh_token
-    access_token = get_access_token(user_gmail)
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
 
     # Get corresponding label ID for passed folder name
-    label_id_dict = list_all_folders(user_id)
-    label_id = label_id_dict.get(label_name)
+    label_ids = resolve_label_ids(user_id, [label_name], create_missing=False)
 
-    if not label_id:
+    if not label_ids:
         print('Label does not exist.')
         return None
     else:
-        url = f'{base_url}{user_id}/labels/{label_id}'
+        url = f'{base_url}{user_id}/labels/{label_ids[0]}'
 
     try:
-        response = requests.delete(url=url, headers=headers)
+        response = google_request('DELETE', url)
         
+        invalidate_label_cache(user_id)
+
         if response.status_code == 204:
             print('Folder successfully deleted')
         
@@ -207,4 +374,26 @@ def remove_label(user_id, label_name):
         raise e
 
     
-    
\ No newline at end of file
+    
+
+# Function to record emails as already ingested
+def mark_emails_processed(user_id, message_ids: list, processed_label):
+    """
+    Add the processed label to emails so later scans can exclude them with -label:<processed>
+
+    user_id: str
+        User's email address
+
+    message_ids: list
+        List of unique email identifiers
+
+    processed_label: str
+        Label name to apply, from get_processed_label for the calling pipeline
+
+    Raises RuntimeError if any email could not be labelled, as it would otherwise be ingested again.
+    """
+    if not message_ids:
+        return
+
+    # move_emails creates the label on first use and raises if any chunk fails
+    move_emails(user_id, message_ids, [processed_label])
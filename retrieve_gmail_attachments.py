@@ -4,7 +4,6 @@ from email.mime.base import MIMEBase
 from email.utils import parsedate_to_datetime
 from email import encoders
 import mimetypes
-import pandas as pd
 # from google_auth_oauthlib.flow import Flow, InstalledAppFlow
 # from googleapiclient.discovery import build
 # from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
@@ -13,112 +12,62 @@ from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 import pickle
 import time
-import requests
 import os
-from bs4 import BeautifulSoup
 import base64
-from get_access_token import get_access_token
+from gmail_fetch import iter_email_message_ids, list_email_message_ids, iter_fetch_messages, imap_bounded, split_workers
+from gmail_sync import list_incremental_message_ids, save_checkpoint, get_sync_label, message_matches_filters
+from gmail_attachments import iter_attachment_parts, download_attachment
+from gmail_body import extract_email_body
 from dotenv import load_dotenv
 
 # Load in directory-specific environem
 load_dotenv()
 
 downloads_dir = os.environ.get('DOWNLOAD_DIR', os.path.join(os.getcwd(), 'Downloads'))
-user_gmail = os.environ['EMAIL']
-access_token = get_access_token(user_gmail)
 
 base_url = 'https://gmail.googleapis.com/gmail/v1/users/'
-headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
 
-def list_email_message_ids(user_id, current_date, days_lookback = None, label_ids: str|list = None, filter_query = None, include_spam_trash_boxes = False, max_results: int = 500):
-    messages_list = []
+def download_message_attachments(user_id, messages_metadata, filename_pattern = None, mime_types = None, max_workers = None, return_message_id = False):
+    """
+    Download the attachments of already fetched messages into DOWNLOAD_DIR
+
+    user_id: str
+        User's email address
 
-    url = f'{base_url}{user_id}/messages'
-    params = [('maxResults', max_results)]
+    messages_metadata: iterable
+        Message resources fetched with at least the 'attachments' profile
 
-    if include_spam_trash_boxes:
-        params.append(('includeSpamTrash', True))
+    filename_pattern: str
+        Only download attachments whose filename matches this shell-style pattern e.g. '*.pdf'
 
-    # Filter emails by date range
-    if days_lookback:
-        start_dt = (current_date - timedelta(days=days_lookback))
-    else:
-        start_dt = (current_date - timedelta(days=1))
+    mime_types: list
+        Only download attachments with one of these MIME types
 
-    end_dt = (current_date + timedelta(days=1))
+    max_workers: int
+        Maximum number of concurrent attachment requests. Defaults to GMAIL_FETCH_CONCURRENCY
 
-    # Convert to UTC timestamps
-    start_ts = int(start_dt.astimezone(timezone.utc).timestamp())
-    end_ts = int(end_dt.astimezone(timezone.utc).timestamp())
-    
-    print(f"Filtering range between {start_dt.strftime('%d/%m/%Y %H:%M')} to {end_dt.strftime('%d/%m/%Y %H:%M')}\n")
+    return_message_id: bool
+        Whether to return (message ID, filename) pairs instead of just the filenames
+    """
+    def iter_attachment_jobs():
+        for message_metadata in messages_metadata:
 
-    q = f"after:{start_ts} before:{end_ts}"
-    if filter_query:
-        q += f' {filter_query}'
-    params.append(('q', q))
+            # Walk the full MIME tree, keeping only attachments that pass the filename/type filters
+            for part in iter_attachment_parts(message_metadata['payload'], filename_pattern, mime_types):
+                yield (message_metadata['id'], part)
 
-    if isinstance(label_ids, list) and len(label_ids) > 0:
-        for label in label_ids:
-            params.append(('labelIds', label))
+    os.makedirs(downloads_dir, exist_ok=True)
 
-    try:
-        response = requests.get(url=url, headers=headers, params=params)
-        response_data =  response.json()
+    # Download attachments concurrently; results keep the order attachments were found in
+    attachments = imap_bounded(lambda job: (job[0], download_attachment(user_id, job[0], job[1], downloads_dir)), iter_attachment_jobs(), max_workers)
+    downloaded_files = [(message_id, filename) for message_id, filename in attachments if filename]
 
-        if 'messages' in response_data:
-            messages_list = response_data['messages']
+    if return_message_id:
+        return downloaded_files
+    return [filename for _, filename in downloaded_files]
 
-    except Exception as e:
-        print('An unexpected error occured on attempting to retrieve email IDs.')
-        raise e
-        
-    return messages_list
 
-def extract_email_body(payload, parse_method='text'):
-    """
-    Extracts the email body in the specified format ('text' or 'html').
-    If only HTML is found but 'text' is requested, it will strip the HTML.
-    """
-    def decode_base64(data):
-        return base64.urlsafe_b64decode(data.encode('utf-8')).decode('utf-8')
-
-    def find_part(parts, mime_type):
-        for part in parts:
-            if part.get('mimeType') == mime_type and 'data' in part.get('body', {}):
-                return decode_base64(part['body']['data'])
-            elif 'parts' in part:
-                result = find_part(part['parts'], mime_type)
-                if result:
-                    return result
-        return None
-
-    # Step 1: Try to find the requested format
-    mime_target = 'text/plain' if parse_method == 'text' else 'text/html'
-    body = None
-
-    if 'parts' in payload:
-        body = find_part(payload['parts'], mime_target)
-    elif payload.get('mimeType') == mime_target and 'data' in payload.get('body', {}):
-        body = decode_base64(payload['body']['data'])
-
-    # Step 2: Fallback - if user wants plain text but only HTML is found
-    if not body and parse_method == 'text':
-        # Try to find HTML and strip it
-        html_body = None
-        if 'parts' in payload:
-            html_body = find_part(payload['parts'], 'text/html')
-        elif payload.get('mimeType') == 'text/html' and 'data' in payload.get('body', {}):
-            html_body = decode_base64(payload['body']['data'])
-
-        if html_body:
-            soup = BeautifulSoup(html_body, 'html.parser')
-            return soup.get_text(separator='\n', strip=True)
-
-    return body or f"[No {parse_method} body found]"
-
-
-def retrieve_gmail_attachments(user_id, current_date, days_lookback = None, label_ids = None, subject_filter = [], email_filter = [], include_spam_trash_boxes = False):
+def retrieve_gmail_attachments(user_id, current_date, days_lookback = None, label_ids = None, subject_filter = [], email_filter = [], include_spam_trash_boxes = False, use_batch = True, max_workers = None, incremental = False, filename_pattern = None, mime_types = None, return_message_id = False):
     """
     Function to retrieve email attachments in specific mailing location and restrict according to conditions
 
@@ -141,10 +90,30 @@ def retrieve_gmail_attachments(user_id, current_date, days_lookback = None, labe
         User-defined string(s) to filter emails based on sender email
 
     return_message_id: bool
-        Whether to return message ID in dataframe output
+        Whether to return (message ID, filename) pairs instead of just the filenames
 
     include_spam_trash_boxes: bool
         Whether to list out emails from the Spam and Trash mailboxes
+
+    use_batch: bool
+        Whether to fetch messages through Gmail's batch endpoint
+
+    max_workers: int
+        Maximum number of message and attachment requests in flight, shared between fetching and downloading.
+        Defaults to GMAIL_FETCH_CONCURRENCY
+
+    incremental: bool
+        Only check messages that arrived since the last incremental run (via Gmail's history API), falling
+        back to the days_lookback window when there is no valid checkpoint yet. The checkpoint advances once
+        every attachment has been downloaded
+
+    filename_pattern: str
+        Only download attachments whose filename matches this shell-style pattern e.g. '*.pdf'
+
+    mime_types: list
+        Only download attachments with one of these MIME types
+
+    Attachments already downloaded to DOWNLOAD_DIR with unchanged content are not downloaded again.
     """
     full_filter_query = ''
 
@@ -169,52 +138,38 @@ def retrieve_gmail_attachments(user_id, current_date, days_lookback = None, labe
     # Define full query to pass into helper function
     full_filter_query = ' '.join([email_query, subject_query]).strip()
 
-    # Filter all emails that meet passed criteria
-    messages_list = list_email_message_ids(user_id=user_id, current_date=current_date, days_lookback=days_lookback, label_ids=label_ids, include_spam_trash_boxes=include_spam_trash_boxes, filter_query=full_filter_query)
-
-    downloaded_files = []
+    # Stream all emails that meet passed criteria; fetching starts while later pages are still being listed
+    def list_message_ids():
+        return (message['id'] for message in iter_email_message_ids(user_id=user_id, current_date=current_date, days_lookback=days_lookback, label_ids=label_ids, include_spam_trash_boxes=include_spam_trash_boxes, filter_query=full_filter_query))
 
-    for _, message in enumerate(messages_list):
-
-        url = f"{base_url}{user_id}/messages/{message['id']}"
-        
-        try:
-            response = requests.get(url, headers=headers)
-            message_metadata = response.json()
-
-        except Exception as e:
-            raise e
-
-        ids = message_id = message_metadata['id']
-        parts = message_metadata['payload'].get('parts', [])
-        for id, part in zip(ids, parts):
-            filename = part.get("filename")
-            body = part.get("body", {})
-            attachment_id = body.get("attachmentId")
-            message_id = message_metadata['id']
+    sync_scope = f'retrieve_gmail_attachments|{label_ids}|{full_filter_query}|{include_spam_trash_boxes}'
+    history_id = None
+    if incremental:
+        sync_label = get_sync_label(label_ids)
+        message_ids, history_id = list_incremental_message_ids(user_id, sync_scope, list_message_ids, [sync_label] if sync_label else None)
+    else:
+        message_ids = list_message_ids()
 
-            if filename and attachment_id:
-                attachment_url = f"{base_url}{user_id}/messages/{message_id}/attachments/{attachment_id}"
-                attachment_response = requests.get(attachment_url, headers=headers)
+    # Downloads are fed straight from the fetch pool, so the two stages share one worker budget
+    fetch_workers, download_workers = split_workers(max_workers)
 
-                if attachment_response.status_code == 200:
-                    attachment_data = attachment_response.json().get('data')
-                    if attachment_data:
-                        attachment_bytes = base64.urlsafe_b64decode(attachment_data.encode('UTF-8'))
-                        file_path = os.path.join(downloads_dir, filename)
+    # Fetch message details in parallel batches rather than one request per message
+    messages_metadata = iter_fetch_messages(user_id, message_ids, use_batch=use_batch, max_workers=fetch_workers, profile='attachments')
 
-                        with open(file_path, 'wb') as f:
-                            f.write(attachment_bytes)
+    # History results are unfiltered; apply the sender/subject filters locally
+    if incremental:
+        messages_metadata = (message_metadata for message_metadata in messages_metadata if message_matches_filters(message_metadata, subject_filter, email_filter))
 
-                        print(f"Downloaded: {filename} -> {file_path}")
-                        downloaded_files.append(filename)
+    downloaded_files = download_message_attachments(user_id, messages_metadata, filename_pattern, mime_types, download_workers, return_message_id)
 
+    # Only advance the sync checkpoint once every attachment is on disk
+    if history_id:
+        save_checkpoint(user_id, sync_scope, history_id)
     return downloaded_files
 
 
 
 
-
     #     message_headers = message_metadata['payload']['headers']
     #     content = extract_email_body(message_metadata['payload'], parse_method)
 
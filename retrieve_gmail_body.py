@@ -4,153 +4,48 @@ from email.mime.base import MIMEBase
 from email.utils import parsedate_to_datetime
 from email import encoders
 import mimetypes
-import pandas as pd
 # from google_auth_oauthlib.flow import Flow, InstalledAppFlow
 # from googleapiclient.discovery import build
 # from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 # from google.auth.transport.requests import Request
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 import pickle
 import time
-import requests
 import os
-from bs4 import BeautifulSoup
 import base64
-from get_access_token import get_access_token
+from gmail_fetch import iter_email_message_ids, list_email_message_ids, iter_fetch_messages
+from gmail_sync import list_incremental_message_ids, save_checkpoint, get_sync_label, message_matches_filters
+from gmail_body import extract_email_body, get_message_headers, EmailBody
 from dotenv import load_dotenv
 
 # Load in directory-specific environem
 load_dotenv()
 
-user_gmail = os.environ['EMAIL']
-
 base_url = 'https://gmail.googleapis.com/gmail/v1/users/'
 
-def list_email_message_ids(user_id, current_date, days_lookback = None, label_ids: str|list = None, filter_query = None, include_spam_trash_boxes = False, max_results: int = 500):
-    access_token = get_access_token(user_gmail)
-    headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
-    
-    messages_list = []
-
-    url = f'{base_url}{user_id}/messages'
-    params = [('maxResults', max_results)]
-
-    if include_spam_trash_boxes:
-        params.append(('includeSpamTrash', True))
-
-    # Filter emails by date range
-    if days_lookback:
-        start_dt = (current_date - timedelta(days=days_lookback))
-    else:
-        start_dt = (current_date - timedelta(days=1))
-
-    end_dt = (current_date + timedelta(days=1))
-
-    # Convert to UTC timestamps
-    start_ts = int(start_dt.astimezone(timezone.utc).timestamp())
-    end_ts = int(end_dt.astimezone(timezone.utc).timestamp())
-    
-    print(f"Filtering range between {start_dt.strftime('%d/%m/%Y %H:%M')} to {end_dt.strftime('%d/%m/%Y %H:%M')}\n")
-
-    q = f"after:{start_ts} before:{end_ts}"
-    if filter_query:
-        q += f' {filter_query}'
-    params.append(('q', q))
-
-    if isinstance(label_ids, list) and len(label_ids) > 0:
-        for label in label_ids:
-            params.append(('labelIds', label))
-
-    try:
-        response = requests.get(url=url, headers=headers, params=params)
-        response_data =  response.json()
-
-        if 'messages' in response_data:
-            messages_list = response_data['messages']
-
-    except Exception as e:
-        print('An unexpected error occured on attempting to retrieve email IDs.')
-        raise e
-        
-    return messages_list
-
-def extract_email_body(payload, parse_method='text'):
+@dataclass(slots=True)
+class EmailRecord:
     """
-    Extracts the email body in the specified format ('text' or 'html').
-    If only HTML is found but 'text' is requested, it will strip the HTML.
+    One message yielded by iter_gmail_messages. Fields the fetch profile does not cover are left as None
     """
-    def decode_base64(data):
-        return base64.urlsafe_b64decode(data.encode('utf-8')).decode('utf-8')
-
-    def find_part(parts, mime_type):
-        for part in parts:
-            if part.get('mimeType') == mime_type and 'data' in part.get('body', {}):
-                return decode_base64(part['body']['data'])
-            elif 'parts' in part:
-                result = find_part(part['parts'], mime_type)
-                if result:
-                    return result
-        return None
-
-    # Step 1: Try to find the requested format
-    mime_target = 'text/plain' if parse_method == 'text' else 'text/html'
-    body = None
-
-    if 'parts' in payload:
-        body = find_part(payload['parts'], mime_target)
-    elif payload.get('mimeType') == mime_target and 'data' in payload.get('body', {}):
-        body = decode_base64(payload['body']['data'])
-
-    # Step 2: Fallback - if user wants plain text but only HTML is found
-    if not body and parse_method == 'text':
-        # Try to find HTML and strip it
-        html_body = None
-        if 'parts' in payload:
-            html_body = find_part(payload['parts'], 'text/html')
-        elif payload.get('mimeType') == 'text/html' and 'data' in payload.get('body', {}):
-            html_body = decode_base64(payload['body']['data'])
-
-        if html_body:
-            soup = BeautifulSoup(html_body, 'html.parser')
-            return soup.get_text(separator='\n', strip=True)
-
-    return body or f"[No {parse_method} body found]"
-
-
-def retrieve_gmail_body(user_id, current_date, days_lookback = None, label_ids = None, return_message_id = False, parse_method = 'text', subject_filter = [], email_filter = [], include_spam_trash_boxes = False):
-    """
-    Function to retrieve emails in specific mailing location and restrict according to conditions
+    id: str
+    date_header: str | None = None
+    sender_email: str | None = None
+    subject: str | None = None
+    body: EmailBody | None = None
 
-    user_id: str
-        User's email address
 
-    current_date: datetime
-        Current date to start filtering for emails
-    
-    days_lookback: int
-        Number of days from current_date to lookback and filter emails
-
-    label_ids: list
-        List of mailing locations and statuses to check for emails
-    
-    subject_filter: list
-        User-defined string(s) to filter emails based on subject
-    
-    email_filter: list
-        User-defined string(s) to filter emails based on sender email
-
-    return_message_id: bool
-        Whether to return message ID in dataframe output
-
-    include_spam_trash_boxes: bool
-        Whether to list out emails from the Spam and Trash mailboxes
+def iter_gmail_messages(user_id, current_date, days_lookback = None, label_ids = None, parse_method = 'text', subject_filter = [], email_filter = [], include_spam_trash_boxes = False, use_batch = True, max_workers = None, fetch_profile = 'full', incremental = False):
     """
-    # creds = get_credentials()
-    # client_id, client_secret, refresh_token = creds.client_id, creds.client_secret, creds.refresh_token
-    access_token = get_access_token(user_gmail)
-    headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
+    Lazily yield an EmailRecord per message in a specific mailing location, restricted according to
+    conditions. Arguments are the same as retrieve_gmail_body's
 
+    date_header is the raw Date header (convert many at once with parse_date_headers) and body is an
+    EmailBody that decodes the message only when read. With incremental=True the sync checkpoint only
+    advances once the last record has been yielded.
+    """
     full_filter_query = ''
 
     # Filter emails by sender email if list not empty
@@ -174,30 +69,46 @@ def retrieve_gmail_body(user_id, current_date, days_lookback = None, label_ids =
     # Define full query to pass into helper function
     full_filter_query = ' '.join([email_query, subject_query]).strip()
 
-    # Filter all emails that meet passed criteria
-    messages_list = list_email_message_ids(user_id=user_id, current_date=current_date, days_lookback=days_lookback, label_ids=label_ids, include_spam_trash_boxes=include_spam_trash_boxes, filter_query=full_filter_query)
+    # Stream all emails that meet passed criteria; fetching starts while later pages are still being listed
+    def list_message_ids():
+        return (message['id'] for message in iter_email_message_ids(user_id=user_id, current_date=current_date, days_lookback=days_lookback, label_ids=label_ids, include_spam_trash_boxes=include_spam_trash_boxes, filter_query=full_filter_query))
 
-    # Initialize dataframe to store all email details 
-    df = pd.DataFrame()
+    sync_scope = f'retrieve_gmail_body|{label_ids}|{full_filter_query}|{include_spam_trash_boxes}'
+    history_id = None
+    if incremental:
+        sync_label = get_sync_label(label_ids)
+        message_ids, history_id = list_incremental_message_ids(user_id, sync_scope, list_message_ids, [sync_label] if sync_label else None)
+    else:
+        message_ids = list_message_ids()
+
+    # Only the message IDs are needed; skip fetching message details entirely
+    if fetch_profile == 'ids':
+        # History results are unfiltered, so sender/subject filters need the message headers
+        if incremental and (email_filter or subject_filter):
+            messages_metadata = iter_fetch_messages(user_id, message_ids, use_batch=use_batch, max_workers=max_workers, profile='metadata')
+            message_ids = (message['id'] for message in messages_metadata if message_matches_filters(message, subject_filter, email_filter))
+
+        for message_id in message_ids:
+            yield EmailRecord(message_id)
 
-    # Define MIME target (whether to parse content as text or html)
-    mime_target = 'text/plain' if parse_method == 'text' else 'text/html'
+        if history_id:
+            save_checkpoint(user_id, sync_scope, history_id)
+        return
 
-    for i, message in enumerate(messages_list):
+    # Fetch message details in parallel batches rather than one request per message
+    messages_metadata = iter_fetch_messages(user_id, message_ids, use_batch=use_batch, max_workers=max_workers, profile=fetch_profile)
 
-        url = f"{base_url}{user_id}/messages/{message['id']}"
-        
-        try:
-            response = requests.get(url, headers=headers)
-            message_metadata = response.json()
+    for message_metadata in messages_metadata:
 
-        except Exception as e:
-            raise e
+        # History results are unfiltered; apply the sender/subject filters locally
+        if incremental and not message_matches_filters(message_metadata, subject_filter, email_filter):
+            continue
 
         message_id = message_metadata['id']
 
-        message_headers = message_metadata['payload']['headers']
-        content = extract_email_body(message_metadata['payload'], parse_method)
+        # Index the headers once rather than scanning the list for each field
+        message_headers = get_message_headers(message_metadata)
+        content = EmailBody(message_metadata['payload'], parse_method) if fetch_profile == 'full' else None
         # content = ''
 
         # if 'parts' in message_metadata['payload']:
@@ -219,32 +130,10 @@ def retrieve_gmail_body(user_id, current_date, days_lookback = None, label_ids =
         #     content += base64.urlsafe_b64decode(message_main_content['data']).decode('utf-8')
         #     content += '\n\n'
 
+        sender_email = message_headers.get('from')
+        message_subject = message_headers.get('subject')
+        date_received = message_headers.get('date')
 
-        sender_email = [header['value'] for header in message_headers if header['name'].lower()=='from'][0]
-        message_subject = [header['value'] for header in message_headers if header['name'].lower()=='subject'][0]
-        date_received = [header['value'] for header in message_headers if header['name'].lower() == 'date'][0]
-        cleaned_date = date_received.split(' (')[0].strip()
-
-        # Normalize timezone names to numeric if needed
-        for name, offset in {"GMT": "+0000", "UTC": "+0000"}.items():
-            if cleaned_date.endswith(name):
-                cleaned_date = cleaned_date.replace(name, offset)
-
-        # Robust parsing
-        try:
-            dt = parsedate_to_datetime(cleaned_date)
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=ZoneInfo("UTC"))
-            dt_myt = dt.astimezone(ZoneInfo("Asia/Kuala_Lumpur"))
-            myt_date_received = dt_myt.strftime('%Y-%m-%d %H:%M:%S')
-
-        except Exception as e:
-            print("Parsing failed for:", cleaned_date, "Error:", e)
-            myt_date_received = "Invalid date"
-        
-        
-        
-        
         # date_recieved = [header['value'] for header in message_headers if header['name'].lower()=='date'][0]
 
         # cleaned_date = date_recieved.split(' (')[0]
@@ -261,24 +150,127 @@ def retrieve_gmail_body(user_id, current_date, days_lookback = None, label_ids =
         # dt_myt = dt.astimezone(ZoneInfo("Asia/Kuala_Lumpur"))  # Convert to MYT
         # myt_date_recieved = dt_myt.strftime('%Y-%m-%d %H:%M:%S')
 
-        if return_message_id:
-            row_df = pd.DataFrame([[message_id, myt_date_received, sender_email, message_subject, content]], 
-                                columns = ['Id', 'Date Recieved', 'Sender Email', 'Subject', 'Body'])
-        
-        else:
-            row_df = pd.DataFrame([[myt_date_received, sender_email, message_subject, content]], 
-                                columns = ['Date Recieved', 'Sender Email', 'Subject', 'Body'])
-            
+        yield EmailRecord(message_id, date_received, sender_email, message_subject, content)
+
+    # Every message has been handed over, so the next incremental run can start from here
+    if history_id:
+        save_checkpoint(user_id, sync_scope, history_id)
 
-        df = pd.concat([df, row_df], axis=0, ignore_index=True)
-        print(f"{dt_myt.strftime('%d%m%Y - %H%M%S')} | {message_subject}")
 
-    return df # messages_list
+def parse_date_headers(date_headers: list):
+    """
+    Convert raw Date header values to Asia/Kuala_Lumpur timestamps in one vectorised pass
+
+    date_headers: list
+        Date header values e.g. 'Mon, 6 Oct 2025 09:15:02 +0800 (MYT)'. None for a missing header
+
+    Returns (Series of datetime64[ns, Asia/Kuala_Lumpur], number of values that could not be parsed and are NaT).
+    """
+    import pandas as pd
+
+    # Drop trailing comments such as ' (MYT)', the optional weekday, and spell GMT/UTC as a numeric offset
+    cleaned = pd.Series(date_headers, dtype=object).str.split(' (', n=1, regex=False).str[0].str.strip()
+    cleaned = cleaned.str.replace(r'^[A-Za-z]{3},\s*', '', regex=True).str.replace(r'\s(?:GMT|UTC|UT)$', ' +0000', regex=True)
+
+    # Nearly every header follows RFC 2822 exactly; parse those with a fixed format
+    parsed = pd.to_datetime(cleaned, format='%d %b %Y %H:%M:%S %z', utc=True, errors='coerce')
+
+    # Only the rest (e.g. no seconds, named zones) go through the slower flexible parser
+    unparsed = parsed.isna() & cleaned.notna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(cleaned[unparsed], format='mixed', utc=True, errors='coerce')
+
+    invalid_count = int(parsed.isna().sum())
+    return parsed.dt.tz_convert('Asia/Kuala_Lumpur').dt.as_unit('ns'), invalid_count
+
+
+def retrieve_gmail_body(user_id, current_date, days_lookback = None, label_ids = None, return_message_id = False, parse_method = 'text', subject_filter = [], email_filter = [], include_spam_trash_boxes = False, use_batch = True, max_workers = None, fetch_profile = 'full', incremental = False, lazy_body = False):
+    """
+    Function to retrieve emails in specific mailing location and restrict according to conditions
 
+    user_id: str
+        User's email address
+
+    current_date: datetime
+        Current date to start filtering for emails
     
+    days_lookback: int
+        Number of days from current_date to lookback and filter emails
 
+    label_ids: list
+        List of mailing locations and statuses to check for emails
     
+    subject_filter: list
+        User-defined string(s) to filter emails based on subject
+    
+    email_filter: list
+        User-defined string(s) to filter emails based on sender email
+
+    return_message_id: bool
+        Whether to return message ID in dataframe output
+
+    include_spam_trash_boxes: bool
+        Whether to list out emails from the Spam and Trash mailboxes
+
+    use_batch: bool
+        Whether to fetch messages through Gmail's batch endpoint
+
+    max_workers: int
+        Maximum number of concurrent message requests. Defaults to GMAIL_FETCH_CONCURRENCY
+
+    fetch_profile: str
+        How much of each message to fetch:
+        'ids' - only list message IDs (output has just the Id column)
+        'metadata' - sender, subject and date headers (no Body column)
+        'full' - headers and decoded body
+
+    incremental: bool
+        Only return messages that arrived since the last incremental run (via Gmail's history API), falling
+        back to the days_lookback window when there is no valid checkpoint yet
+
+    lazy_body: bool
+        Fill the Body column with EmailBody objects that decode the message only when their text is read,
+        instead of decoding every body up front
+
+    The Date Recieved column holds datetime64[ns, Asia/Kuala_Lumpur] values, with NaT where the Date header
+    could not be parsed.
+    """
+    import pandas as pd
+
+    records = iter_gmail_messages(user_id, current_date, days_lookback, label_ids, parse_method, subject_filter, email_filter, include_spam_trash_boxes, use_batch, max_workers, fetch_profile, incremental)
+
+    if fetch_profile == 'ids':
+        df = pd.DataFrame({'Id': [record.id for record in records]})
+        print(f'{len(df)} message(s) found')
+        return df
+
+    # Gather each field into its own list and build the DataFrame once, rather than concatenating row by row
+    ids, date_headers, sender_emails, subjects, bodies = [], [], [], [], []
+    for record in records:
+        ids.append(record.id)
+        date_headers.append(record.date_header)
+        sender_emails.append(record.sender_email)
+        subjects.append(record.subject)
+
+        if fetch_profile == 'full':
+            bodies.append(record.body if lazy_body else record.body.text)
+
+    dates_received, invalid_count = parse_date_headers(date_headers)
+    if invalid_count:
+        print(f'{invalid_count} message(s) had a missing or unparseable Date header (set to NaT)')
+
+    for received, subject in zip(dates_received.dt.strftime('%d%m%Y - %H%M%S').fillna('Invalid date'), subjects):
+        print(f"{received} | {subject}")
 
+    columns = {}
+    if return_message_id:
+        columns['Id'] = ids
 
+    columns['Date Recieved'] = dates_received
+    columns['Sender Email'] = sender_emails
+    columns['Subject'] = subjects
 
+    if fetch_profile == 'full':
+        columns['Body'] = bodies
 
+    return pd.DataFrame(columns)
@@ -3,22 +3,15 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 import mimetypes
-import time
 import os
 import pickle
 import base64
-import requests
-import pandas as pd
-from get_access_token import get_access_token
+from google_api_client import google_request
 from dotenv import load_dotenv
 
 # Load in directory-specific environem
 load_dotenv()
 
-user_gmail = os.environ['EMAIL']
-
-access_token = get_access_token(user_gmail)
-
 def append_attachment_file(attachment_directory: str, attachment: str, mime_message: MIMEMultipart):
     attachment_path = os.path.join(attachment_directory, attachment)
             
@@ -90,32 +83,10 @@ def send_email_gmail(sender_address, email_to: list, email_cc: list, email_bcc:
 
     url = f'https://gmail.googleapis.com/gmail/v1/users/{sender_address}/messages/send'
 
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-
     body = {
         'raw': raw_message
     }
 
-    max_retries = 5
-    attempt = 0
-    for _ in range(max_retries):
-        try:
-            response = requests.post(url, headers=headers, json=body)
-            response.raise_for_status()
-            print(f"Mail successfully sent to {', '.join([mime_message['to'], mime_message['Cc']])}".removesuffix(', '))
-            break
-        
-        except Exception as e:
-            if attempt == max_retries:
-                print('Maximum number of retries reached...')
-                raise e
-            else:
-                time.sleep(10)
-                attempt += 1
-                continue
-
-        
-    
\ No newline at end of file
+    response = google_request('POST', url, json=body)
+    response.raise_for_status()
+    print(f"Mail successfully sent to {', '.join([mime_message['to'], mime_message['Cc']])}".removesuffix(', '))